@@ -0,0 +1,243 @@
+#!/usr/bin/python3
+"""
+Benchmarks for ssh-browse against synthetic fleets.
+Generates ssh configs with categories, aliases and Includes, times parsing, searching,
+rendering against a fake curses screen and probing a local stub server,
+and prints the results as JSON.
+
+    python3 bench/ssh_browse_bench.py --sizes 1000 10000 100000 > results.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import asyncio
+import platform
+import tempfile
+import threading
+import collections
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import ssh_hosts
+import ssh_search
+import ssh_browse
+import ssh_notes
+
+CATEGORIES = ['Web', 'Db', 'Cache', 'Queue', 'Lab', 'Build', 'Edge', 'Storage']
+QUERY = 'web-prod-01'
+NOTES_QUERY = 'postgres primary'
+NOTES_WORDS = ['postgres', 'primary', 'replica', 'backup', 'nginx', 'upstream', 'kernel', 'patched',
+               'rack', 'owner', 'oncall', 'migrated', 'disk', 'raid', 'firmware', 'vlan']
+
+def generate_config(directory, count, port=22) -> str:
+    """
+    Writes a config for `count` hosts to `directory` and returns the path of the main file.
+    Each category is in its own file, pulled in by an Include, and every host has an alias.
+    """
+    main_filename = os.path.join(directory, 'config')
+    with open(main_filename, 'w') as main:
+        main.write('Host *\n    ServerAliveInterval 30\n\n')
+        for c, category in enumerate(CATEGORIES):
+            filename = os.path.join(directory, f'{category.lower()}.conf')
+            main.write(f'Include {filename}\n')
+            with open(filename, 'w') as file:
+                file.write(f'# {category}\n')
+                for i in range(c, count, len(CATEGORIES)):
+                    environment = 'prod' if i % 3 else 'test'
+                    name = f'{category.lower()}-{environment}-{i:06d}'
+                    file.write(f'Host {name} {category.lower()}{i}\n')
+                    file.write(f'    HostName 127.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}\n')
+                    file.write(f'    User deploy\n')
+                    file.write(f'    Port {port}\n')
+    return main_filename
+
+class FakeScreen:
+    # Just enough of a curses window for the render functions
+    def __init__(self, lines, columns):
+        self.lines = lines
+        self.columns = columns
+        self.writes = 0
+
+    def getmaxyx(self):
+        return self.lines, self.columns
+
+    def addstr(self, y, x, text, attr=0):
+        self.writes += 1
+
+    def move(self, y, x):
+        pass
+
+    def clrtoeol(self):
+        pass
+
+    def erase(self):
+        pass
+
+def timed(function, *args, repeat=1) -> float:
+    # Best of `repeat` runs, in seconds
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_parsing(filename, results, count):
+    results.append({'name': 'read_ssh_config', 'hosts': count, 'seconds': timed(ssh_hosts.read_ssh_config, filename, repeat=3)})
+    with tempfile.TemporaryDirectory() as directory:
+        cache_filename = os.path.join(directory, 'ssh_config.cache')
+        results.append({'name': 'load_ssh_config_cold', 'hosts': count, 'seconds': timed(ssh_hosts.load_ssh_config, filename, cache_filename)})
+        results.append({'name': 'load_ssh_config_cached', 'hosts': count, 'seconds': timed(ssh_hosts.load_ssh_config, filename, cache_filename, repeat=3)})
+
+        def change_one_file():
+            # What a reload costs after a host was added to one included file
+            with open(os.path.join(os.path.dirname(filename), f'{CATEGORIES[0].lower()}.conf'), 'a') as file:
+                file.write(f'Host added-{time.perf_counter_ns()}\n    HostName 127.0.0.1\n')
+            ssh_hosts.load_ssh_config(filename, cache_filename)
+        results.append({'name': 'load_ssh_config_one_file_changed', 'hosts': count, 'seconds': timed(change_one_file, repeat=3)})
+    ssh_config_data = ssh_hosts.read_ssh_config(filename)
+    results.append({'name': 'get_categories', 'hosts': count, 'seconds': timed(ssh_hosts.get_categories, ssh_config_data, repeat=3)})
+    return ssh_config_data
+
+def bench_search(ssh_config_data, results, count):
+    def build_index():
+        search_index = ssh_search.SearchIndex(ssh_config_data)
+        while search_index.character_rankings is None:
+            time.sleep(0.001)
+        return search_index
+
+    results.append({'name': 'search_index', 'hosts': count, 'seconds': timed(build_index)})
+    for fuzzy in (False, True):
+        # A fresh index each time, so no query is answered from the previous run's results
+        search_index = build_index()
+        keystrokes = []
+        rankings = []
+        for i in range(1, len(QUERY) + 1):
+            keystrokes.append(timed(ssh_browse.get_hosts_to_display, search_index, 'All', QUERY[:i], fuzzy))
+            # Large fuzzy searches are ranked in the background, the next key is pressed once they're shown
+            start = time.perf_counter()
+            while search_index.ranking is not None:
+                time.sleep(0.001)
+            rankings.append(time.perf_counter() - start)
+        result = {
+            'name': f"get_hosts_to_display_{'fuzzy' if fuzzy else 'substring'}",
+            'hosts': count,
+            'seconds': sum(keystrokes),
+            'max_keystroke_seconds': max(keystrokes)}
+        if fuzzy:
+            result['max_ranking_seconds'] = max(rankings)
+        results.append(result)
+
+def bench_render(ssh_config_data, results, count):
+    screen = FakeScreen(50, 200)
+    size = os.terminal_size((screen.columns, screen.lines))
+    colors = collections.defaultdict(int)
+    config = ssh_browse.RenderConfig(40, 40, 4, 2, 0, colors)
+    host_list = ssh_browse.HostListView()
+    host_list.update(list(ssh_config_data), screen.lines - config.top_margin - config.footer_height)
+    status_counter = ssh_browse.StatusCounter(ssh_config_data)
+
+    class NoCache:
+        def age(self, hostname, now=None):
+            return None
+
+    def render_frame():
+        ssh_browse.render_hosts(screen, host_list, ssh_config_data, {}, config, NoCache())
+        ssh_browse.render_footer(screen, status_counter, size, config)
+
+    def scroll():
+        # A full frame after every key press while holding down
+        for _ in range(100):
+            host_list.move(1)
+            render_frame()
+
+    results.append({'name': 'render_frame', 'hosts': count, 'seconds': timed(render_frame, repeat=5)})
+    results.append({'name': 'render_scroll_100', 'hosts': count, 'seconds': timed(scroll, repeat=3)})
+
+def bench_notes(ssh_config_data, results, count, notes_hosts):
+    # Notes of about 4 KB for up to `notes_hosts` hosts, with a ticket number and an address in each
+    hostnames = list(ssh_config_data)[:notes_hosts]
+    with tempfile.TemporaryDirectory() as directory:
+        for i, hostname in enumerate(hostnames):
+            words = [NOTES_WORDS[(i * 7 + j * 13) % len(NOTES_WORDS)] for j in range(500)]
+            with open(os.path.join(directory, hostname), 'w') as file:
+                file.write(f'INC-{i:06d} 10.{i >> 8 & 255}.{i & 255}.1\n' + ' '.join(words) + '\n')
+        index_filename = os.path.join(directory, 'notes_index.json')
+
+        notes_index = ssh_notes.NotesIndex(directory, index_filename)
+        results.append({'name': 'notes_index_build', 'hosts': len(hostnames), 'seconds': timed(notes_index.update, hostnames)})
+        results.append({'name': 'notes_index_update_unchanged', 'hosts': len(hostnames), 'seconds': timed(notes_index.update, hostnames, repeat=3)})
+        results.append({'name': 'notes_index_load', 'hosts': len(hostnames), 'seconds': timed(ssh_notes.NotesIndex(directory, index_filename).load, repeat=3)})
+
+        keystrokes = []
+        for i in range(1, len(NOTES_QUERY) + 1):
+            # A fresh cache for every keystroke, like the first time a query is typed
+            notes_index._build()
+            keystrokes.append(timed(notes_index.search, NOTES_QUERY[:i]))
+        results.append({
+            'name': 'notes_index_search',
+            'hosts': len(hostnames),
+            'seconds': sum(keystrokes),
+            'max_keystroke_seconds': max(keystrokes)})
+
+class StubServer:
+    # Local listener that greets like an ssh server, on its own thread
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        self.port = None
+
+        async def greet(reader, writer):
+            writer.write(b'SSH-2.0-OpenSSH_9.0 bench\r\n')
+            await writer.drain()
+            writer.close()
+
+        async def start():
+            self.server = await asyncio.start_server(greet, '127.0.0.1', 0, backlog=4096)
+            self.port = self.server.sockets[0].getsockname()[1]
+            ready.set()
+
+        self.thread = threading.Thread(target=lambda: (self.loop.run_until_complete(start()), self.loop.run_forever()), daemon=True)
+        self.thread.start()
+        ready.wait()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+def bench_probing(results, count, probe_hosts):
+    stub = StubServer()
+    hosts = min(count, probe_hosts)
+    ssh_config_data = {f'host{i}': {'Category': 'Bench', 'HostName': '127.0.0.1', 'Port': str(stub.port)} for i in range(hosts)}
+    seconds = timed(ssh_hosts.check_reachable_all, ssh_config_data, True, 64, 5, 'banner')
+    reachable = sum(1 for hostconfig in ssh_config_data.values() if hostconfig['Reachable'] == 'yes')
+    results.append({'name': 'check_reachable_all_banner', 'hosts': hosts, 'seconds': seconds, 'reachable': reachable})
+    stub.stop()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs='+', default=[1000, 10000], help = "number of hosts in each synthetic config")
+    parser.add_argument("--probe-hosts", type=int, default=2000, help = "maximum number of hosts probed against the stub server")
+    parser.add_argument("--notes-hosts", type=int, default=5000, help = "maximum number of hosts with notes in the notes index benchmark")
+    parser.add_argument("--skip-probes", help = "don't run the probe benchmark", action="store_true")
+    args = parser.parse_args()
+
+    results = []
+    for count in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            filename = generate_config(directory, count)
+            ssh_config_data = bench_parsing(filename, results, count)
+        bench_search(ssh_config_data, results, count)
+        bench_render(ssh_config_data, results, count)
+        bench_notes(ssh_config_data, results, count, args.notes_hosts)
+        if not args.skip_probes:
+            bench_probing(results, count, args.probe_hosts)
+
+    print(json.dumps({
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'results': results}, indent=2))
@@ -21,7 +21,7 @@ fi
 mkdir -p "$INSTALL_DIR"
 
 # Copy Python files to the organized directory and make them executable
-FILES=("ssh_browse.py" "ssh_hosts.py" "tmux_split.py")
+FILES=("ssh_browse.py" "ssh_hosts.py" "ssh_probe.py" "ssh_cache.py" "ssh_search.py" "ssh_model.py" "ssh_pool.py" "ssh_exec.py" "ssh_monitor.py" "ssh_notes.py" "ssh_daemon.py" "ssh_dns.py" "ssh_reload.py" "tmux_split.py")
 for file in "${FILES[@]}"; do
     if [[ -f "$SOURCE_DIR/$file" ]]; then
         cp "$SOURCE_DIR/$file" "$INSTALL_DIR"
@@ -1,25 +1,159 @@
 #!/usr/bin/python3
+import time
+# Taken before the other imports, so --profile-startup includes them
+STARTED = time.perf_counter()
 import curses.ascii
 import os
-import subprocess
 import atexit
 import curses
 import curses.panel
 import ssh_hosts
-import tmux_split
+import ssh_cache
+import ssh_search
+import ssh_model
+import ssh_notes
 import pwd
 import json
 import argparse
+import select
+import signal
+import sys
+
+class DirtyState:
+    """
+    What has to be redrawn on the next frame.
+    `full` redraws everything, `rows` holds hosts whose row changed, `selection` redraws
+    the properties and categories of the selected host and `footer` redraws the footer.
+    """
+    def __init__(self):
+        self.full = True
+        self.rows = set()
+        self.selection = False
+        self.footer = False
+
+    def clear(self):
+        self.full = False
+        self.rows.clear()
+        self.selection = False
+        self.footer = False
+
+class StatusCounter:
+    """
+    Number of hosts in each reachability state. Kept up to date as states change,
+    so the footer doesn't have to count every host on each frame.
+    """
+    def __init__(self, ssh_config_data):
+        self.counts = {}
+        for hostconfig in ssh_config_data.values():
+            state = hostconfig.reachable
+            self.counts[state] = self.counts.get(state, 0) + 1
+
+    def get(self, state) -> int:
+        return self.counts.get(state, 0)
+
+    def update(self, old_state, new_state):
+        self.counts[old_state] = self.counts.get(old_state, 0) - 1
+        self.counts[new_state] = self.counts.get(new_state, 0) + 1
+
+    def set_state(self, hostconfig, state):
+        self.update(hostconfig.reachable, state)
+        hostconfig['Reachable'] = state
+
+    def add(self, hostconfig):
+        self.counts[hostconfig.reachable] = self.counts.get(hostconfig.reachable, 0) + 1
+
+    def remove(self, hostconfig):
+        self.counts[hostconfig.reachable] = self.counts.get(hostconfig.reachable, 0) - 1
+
+class HostListView:
+    """
+    The part of the host list that fits on screen. Only the `height` rows from
+    `scroll_pos` are rendered, so a frame costs the same no matter how many hosts there are.
+    """
+    def __init__(self):
+        self.hosts = []
+        self.selected = 0
+        self.scroll_pos = 0
+        self.height = 1
+
+    def update(self, hosts, height):
+        self.hosts = hosts
+        self.height = max(1, height)
+        self.select(self.selected)
+
+    def select(self, index):
+        # Keeps the selection inside the list and scrolls just enough to show it
+        self.selected = max(0, min(index, len(self.hosts) - 1))
+        if self.selected < self.scroll_pos:
+            self.scroll_pos = self.selected
+        elif self.selected >= self.scroll_pos + self.height:
+            self.scroll_pos = self.selected - self.height + 1
+        self.scroll_pos = max(0, min(self.scroll_pos, len(self.hosts) - self.height))
+
+    def move(self, delta):
+        self.select(self.selected + delta)
+
+    def page_up(self):
+        self.move(-self.height)
+
+    def page_down(self):
+        self.move(self.height)
+
+    def home(self):
+        self.select(0)
+
+    def end(self):
+        self.select(len(self.hosts) - 1)
+
+    def visible(self) -> list:
+        return self.hosts[self.scroll_pos:self.scroll_pos + self.height]
+
+    def selected_host(self):
+        return self.hosts[self.selected] if self.hosts else None
 
 class RenderConfig:
     def __init__(self, col1_length, col2_length, spacer, top_margin, selected_host, colors):
         self.col1_length = col1_length
         self.col2_length = col2_length
+        self.preferred_col2_length = col2_length
         self.spacer = spacer
         self.top_margin = top_margin
         self.colors = colors
         self.selected_host = selected_host
         self.footer_height = 1
+        # Room left after the host name for the age of the last probe
+        self.age_length = 4
+
+    def fit_columns(self, ssh_config_data, hosts, max_width):
+        """
+        Widens the columns to fit `hosts`, the rows on screen, instead of measuring every host up front.
+        Columns never shrink, so scrolling doesn't make them jump back and forth.
+        The properties column is cut to what is left of `max_width` after the host column.
+        """
+        for host in hosts:
+            self.col1_length = max(self.col1_length, len(host) + self.spacer + self.age_length)
+            for prop, val in ssh_config_data[host].properties():
+                self.preferred_col2_length = max(self.preferred_col2_length, len(prop), len(str(val)))
+        self.col2_length = min(self.preferred_col2_length, max_width - self.col1_length - self.spacer)
+
+class StartupProfile:
+    """
+    Seconds from the start of ssh-browse to each startup stage, printed by --profile-startup.
+    """
+    def __init__(self, started):
+        self.started = started
+        self.stages = []
+
+    def mark(self, stage):
+        self.stages.append((stage, time.perf_counter() - self.started))
+
+    def report(self) -> str:
+        lines = []
+        previous = 0
+        for stage, elapsed in self.stages:
+            lines.append(f'{stage:<20} {elapsed * 1000:8.1f} ms  (+{(elapsed - previous) * 1000:.1f} ms)')
+            previous = elapsed
+        return '\n'.join(lines)
 
 
 # Wsl2 compatibility
@@ -38,24 +172,115 @@ def get_themes_location():
     user = pwd.getpwuid(id).pw_name
     return f'/home/{user}/.ssh-browse/themes.json'
 
-def get_hosts_to_display(ssh_config_data, selected_category, search_filter):
-    hosts = []
-    for k, v in ssh_config_data.items():
-        if selected_category != 'All' and v['Category'] != selected_category:
+def get_ssh_config_cache_location():
+    id = os.getuid()
+    user = pwd.getpwuid(id).pw_name
+    return f'/home/{user}/.ssh-browse/ssh_config.cache'
+
+def get_reachability_cache_location():
+    id = os.getuid()
+    user = pwd.getpwuid(id).pw_name
+    return f'/home/{user}/.ssh-browse/reachability.json'
+
+def get_dns_cache_location():
+    id = os.getuid()
+    user = pwd.getpwuid(id).pw_name
+    return f'/home/{user}/.ssh-browse/dns.json'
+
+def get_notes_index_location():
+    id = os.getuid()
+    user = pwd.getpwuid(id).pw_name
+    return f'/home/{user}/.ssh-browse/notes_index.json'
+
+def get_control_path_location():
+    id = os.getuid()
+    user = pwd.getpwuid(id).pw_name
+    return f'/home/{user}/.ssh-browse/cm'
+
+def get_window_monitor_location():
+    # One pipe per ssh-browse process, windows report to the instance that opened them
+    id = os.getuid()
+    user = pwd.getpwuid(id).pw_name
+    return f'/home/{user}/.ssh-browse/windows-{os.getpid()}.fifo'
+
+def format_age(seconds) -> str:
+    # At most three characters, so it fits between the host name and the properties column
+    if seconds < 60:
+        return f'{int(seconds)}s'
+    if seconds < 3600:
+        return f'{int(seconds // 60)}m'
+    if seconds < 86400:
+        return f'{int(seconds // 3600)}h'
+    return f'{min(int(seconds // 86400), 99)}d'
+
+def format_latency(seconds) -> str:
+    return f'{seconds * 1000:.0f} ms'
+
+def get_unreachable_message(hostname, reachable) -> str:
+    return f"Host {hostname} does not resolve" if reachable == 'dns' else f"Host {hostname} is not reachable"
+
+def get_stats_text(ssh_config_data, reachability_cache, categories):
+    """
+    Latency percentiles per category, the failures by class and the slowest hosts,
+    from the last probe result of each host.
+    """
+    title = "Probe statistics"
+    latencies = {}
+    failures = {}
+    slowest = []
+    for hostname, hostconfig in ssh_config_data.items():
+        entry = reachability_cache.get(hostname)
+        if entry is None or entry.latency is None:
             continue
-        if search_filter.lower() in k.lower():
-            hosts.append(k)
-        elif search_filter.lower() in v['HostName'].lower():
-            hosts.append(k)
-    return hosts
-
-def get_preview_content(filename):
-    try:
-        with open(filename, 'r') as file:
-            return file.readlines()
-    except FileNotFoundError:
-        return [f'No notes found for {filename}']
+        if entry.reachable == 'yes':
+            latencies.setdefault('All', []).append(entry.latency)
+            latencies.setdefault(hostconfig.category, []).append(entry.latency)
+            slowest.append((entry.latency, hostname))
+        elif entry.failure is not None:
+            failures[entry.failure] = failures.get(entry.failure, 0) + 1
+
+    content = [f"{'Category':<20} {'Online':>6} {'p50':>8} {'p95':>8}"]
+    for category in categories:
+        values = sorted(latencies.get(category, []))
+        if values:
+            p50 = format_latency(ssh_cache.percentile(values, 0.5))
+            p95 = format_latency(ssh_cache.percentile(values, 0.95))
+            content.append(f"{category[:20]:<20} {len(values):>6} {p50:>8} {p95:>8}")
+    content.append('')
+    breakdown = ', '.join(f'{failure} {count}' for failure, count in sorted(failures.items(), key=lambda item: -item[1]))
+    content.append(f"Failures: {breakdown or 'none'}")
+    if slowest:
+        content += ['', 'Slowest hosts:']
+        for latency, hostname in sorted(slowest, reverse=True)[:5]:
+            content.append(f"  {hostname[:30]:<30} {format_latency(latency):>8}")
+    return title, content
+
+def get_hosts_to_display(search_index, selected_category, search_filter, fuzzy=False):
+    if fuzzy:
+        return search_index.search_fuzzy(selected_category, search_filter)
+    return search_index.search(selected_category, search_filter)
+
+def get_preview_content(notes_cache, filename, width, start, count) -> tuple:
+    # Returns (start, lines) of the notes, start is moved back when scrolled past the end
+    notes = notes_cache.get(filename, width)
+    if notes is None:
+        return 0, [f'No notes found for {filename}']
         #return [f'No notes found']
+    return notes.lines(start, count)
+
+def restore_reachability(hostname, hostconfig, reachability_cache, ping_on_startup) -> bool:
+    # Shows the last known state of a host, returns True if it should be probed
+    entry = reachability_cache.get(hostname)
+    if entry is not None:
+        hostconfig['Reachable'] = entry.reachable
+        hostconfig.latency = entry.latency
+    if reachability_cache.is_stale(hostname):
+        if entry is not None:
+            return True
+        elif ping_on_startup == 'true':
+            hostconfig['Reachable'] = 'pinging'
+            return True
+    return False
 
 def get_help_text():
     title = "SSH Browse Help"
@@ -63,16 +288,20 @@ def get_help_text():
         "<enter> - Connect host",
         "<space> - Select host",
         "Up/Down - Navigate hosts",
+        "PgUp/PgDn/Home/End - Jump in hosts",
         "Left/Right - Change category",
         "1-9 - Select category",
         "a - Ping visible hosts",
         "p - Ping selected hosts",
+        "m - Toggle monitoring",
         "h - Toggle help",
-        "n - Toggle notes",
-        "s - Search panel",
+        "i - Toggle probe statistics",
+        "n - Toggle notes ([/] - scroll)",
+        "s - Search panel (tab - fuzzy)",
         "e - Edit notes",
         "t - Tmux hosts",
         "w - Tmux windows (nested)",
+        "x - Run command on selected hosts",
         "d - Run demo or die",
         "q - Quit"
     ]
@@ -83,52 +312,79 @@ def render_header(stdscr, config):
     stdscr.addstr(0, config.col1_length, 'Properties', config.colors['COL_HEADER'])
     stdscr.addstr(0, config.col1_length + config.col2_length + config.spacer, 'Categories', config.colors['COL_HEADER'])
 
-def render_hosts(stdscr, hosts, ssh_config_data, selected_hosts, scroll_pos, config):
-    for i, host in enumerate(hosts):
-        if ssh_config_data[host].get('Reachable') == 'yes':
-            pretext = 'o '
-            color = config.colors['COL_ACTIVE']
-        elif ssh_config_data[host].get('Reachable') == 'no':
-            pretext = 'x '
-            color = config.colors['COL_INACTIVE']
-        elif ssh_config_data[host].get('Reachable') == 'pinging':
-            pretext = '? '
-            color = config.colors['COL_UNKNOWN']
-        else:
-            pretext = '> '
-            color = config.colors['COL_UNKNOWN']
-
-        if host in selected_hosts:
-            color = config.colors['COL_SELECTION'] | curses.A_DIM if color == config.colors['COL_INACTIVE'] else config.colors['COL_SELECTION']
-        
-        if i + config.top_margin < stdscr.getmaxyx()[0] - 1:
-            stdscr.addstr(i + config.top_margin, 4, pretext + host, color)
-            if config.selected_host == i + scroll_pos:
-                stdscr.addstr(i + config.top_margin, 1, '->', config.colors['COL_ARROW'])
-
-def render_properties(stdscr, ssh_config_data, hosts, config):
+def render_host_row(stdscr, row, host, hostconfig, marked, selected, config, age):
+    reachability = hostconfig.reachability
+    if reachability == ssh_model.REACHABLE:
+        pretext = 'o '
+        color = config.colors['COL_ACTIVE']
+    elif reachability == ssh_model.UNREACHABLE:
+        pretext = 'x '
+        color = config.colors['COL_INACTIVE']
+    elif reachability == ssh_model.UNRESOLVED:
+        pretext = '! '
+        color = config.colors['COL_DNS']
+    elif reachability == ssh_model.PINGING:
+        pretext = '? '
+        color = config.colors['COL_UNKNOWN']
+    else:
+        pretext = '> '
+        color = config.colors['COL_UNKNOWN']
+
+    if marked:
+        color = config.colors['COL_SELECTION'] | curses.A_DIM if reachability in (ssh_model.UNREACHABLE, ssh_model.UNRESOLVED) else config.colors['COL_SELECTION']
+
+    stdscr.addstr(row, 4, pretext + host, color)
+    if age is not None and reachability != ssh_model.PINGING:
+        age_text = format_age(age)
+        stdscr.addstr(row, config.col1_length - 1 - len(age_text), age_text, config.colors['COL_UNKNOWN'] | curses.A_DIM)
+    if selected:
+        stdscr.addstr(row, 1, '->', config.colors['COL_ARROW'])
+
+def render_hosts(stdscr, host_list, ssh_config_data, selected_hosts, config, reachability_cache, only=None):
+    # Renders the visible rows, or only the visible rows of the hosts in `only`
+    now = time.time()
+    for i, host in enumerate(host_list.visible()):
+        if only is not None:
+            if host not in only:
+                continue
+            clear_host_row(stdscr, i + config.top_margin, config)
+        age = reachability_cache.age(host, now)
+        render_host_row(stdscr, i + config.top_margin, host, ssh_config_data[host], host in selected_hosts, host_list.selected == i + host_list.scroll_pos, config, age)
+
+def clear_host_row(stdscr, row, config):
+    # Clears the hosts column of a row, leaving the properties and categories alone
+    stdscr.addstr(row, 0, ' ' * min(config.col1_length, stdscr.getmaxyx()[1] - 1))
+
+def clear_properties(stdscr, config):
+    for row in range(config.top_margin, stdscr.getmaxyx()[0] - config.footer_height):
+        stdscr.move(row, config.col1_length)
+        stdscr.clrtoeol()
+
+def render_properties(stdscr, ssh_config_data, hosts, config, reachability_cache):
     hostname = hosts[config.selected_host]
     selected_host_config = ssh_config_data[hostname]
-    propertylist = list(selected_host_config.keys())
-    valuelist = list(selected_host_config.values())
-    hostcolor = config.colors['COL_ACTIVE'] if selected_host_config.get('Reachable') == 'yes' else config.colors['COL_INACTIVE'] if selected_host_config.get('Reachable') == 'no' else config.colors['COL_UNKNOWN']
+    reachability = selected_host_config.reachability
+    hostcolor = config.colors['COL_ACTIVE'] if reachability == ssh_model.REACHABLE else config.colors['COL_INACTIVE'] if reachability == ssh_model.UNREACHABLE else config.colors['COL_DNS'] if reachability == ssh_model.UNRESOLVED else config.colors['COL_UNKNOWN']
     stdscr.addstr(0 + config.top_margin, config.col1_length, hostname, hostcolor)
 
-    # Remove 'Category' and 'Reachable' from propertylist and valuelist
-    if 'Category' in propertylist:
-        index = propertylist.index('Category')
-        propertylist.pop(index)
-        valuelist.pop(index)
-    if 'Reachable' in propertylist:
-        index = propertylist.index('Reachable')
-        propertylist.pop(index)
-        valuelist.pop(index)
-        
-    for i, (prop, val) in enumerate(zip(propertylist, valuelist)):
+    # Reachable and Category aren't part of the properties, they are shown in the other columns
+    properties = selected_host_config.properties()
+
+    # The last probe result, shown like a property
+    entry = reachability_cache.get(hostname)
+    if entry is not None and entry.latency is not None:
+        if entry.reachable == 'yes':
+            properties.append(('Probe', format_latency(entry.latency)))
+        elif entry.reachable == 'dns':
+            properties.append(('Probe', 'HostName does not resolve'))
+        else:
+            properties.append(('Probe', f'failed ({entry.failure or "unknown"})'))
+
+    for i, (prop, val) in enumerate(properties):
         stdscr.addstr(i + 1 + config.top_margin, config.col1_length, f'{prop}: {val}', config.colors['COL_PROPERTIES'])
 
 def render_categories(stdscr, ssh_config_data, hosts, categories, selected_category, render_config):
-    selected_host_category = ssh_config_data[hosts[render_config.selected_host]]['Category']
+    selected_host_category = ssh_config_data[hosts[render_config.selected_host]].category
     max_lines = stdscr.getmaxyx()[0] - render_config.top_margin - render_config.footer_height
     selected_host_category_index = categories.index(selected_host_category)
     category_scroll_pos = max(0, selected_host_category_index - max_lines + 1) if selected_host_category_index >= max_lines else 0
@@ -138,14 +394,22 @@ def render_categories(stdscr, ssh_config_data, hosts, categories, selected_categ
         if i + render_config.top_margin < stdscr.getmaxyx()[0] - 1:
             stdscr.addstr(i + render_config.top_margin, render_config.col1_length + render_config.col2_length + render_config.spacer, f'{category_scroll_pos + i + 1}. {category}', color)
 
-def render_footer(stdscr, ssh_config_data, size, config):
+def render_footer(stdscr, status_counter, size, config, message=None, monitoring=False):
+    stdscr.move(size.lines - 1, 0)
+    stdscr.clrtoeol()
+    if message:
+        stdscr.addstr(size.lines - 1, 1, message, config.colors['COL_FOOTER'])
+        return
     ssh_agent_running = 'yes' if os.environ.get('SSH_AUTH_SOCK') else 'no'
-    hosts_online = len([host for host in ssh_config_data if ssh_config_data[host].get('Reachable') == 'yes'])
-    hosts_offline = len([host for host in ssh_config_data if ssh_config_data[host].get('Reachable') == 'no'])
-    hosts_unknown = len([host for host in ssh_config_data if ssh_config_data[host].get('Reachable') == 'unknown'])
+    hosts_online = status_counter.get('yes')
+    hosts_offline = status_counter.get('no')
+    hosts_unknown = status_counter.get('unknown')
+    hosts_unresolved = status_counter.get('dns')
     
     #stdscr.addstr(size.lines - 2, 1, "<enter> - connect | h - help | q - quit", config.colors['COL_FOOTER'])
-    stdscr.addstr(size.lines - 1, 1, f"Online: {hosts_online}, Offline: {hosts_offline}, Unknown: {hosts_unknown}, Agent: {ssh_agent_running} (Press h for help)", config.colors['COL_FOOTER'])
+    dns_text = f', DNS failed: {hosts_unresolved}' if hosts_unresolved else ''
+    monitor_text = ', Monitor: on' if monitoring else ''
+    stdscr.addstr(size.lines - 1, 1, f"Online: {hosts_online}, Offline: {hosts_offline}{dns_text}, Unknown: {hosts_unknown}, Agent: {ssh_agent_running}{monitor_text} (Press h for help)", config.colors['COL_FOOTER'])
 
 def render_help_panel(stdscr, title, content, config, panel=None):
     size = stdscr.getmaxyx()
@@ -163,6 +427,9 @@ def render_help_panel(stdscr, title, content, config, panel=None):
         panel = curses.panel.new_panel(win)
     else:
         win = panel.window()
+        # The content of a panel that is kept open can change size
+        if win.getmaxyx() != (win_height, win_width):
+            win.resize(win_height, win_width)
         win.erase()
         win.box()
 
@@ -187,6 +454,11 @@ def render_preview_panel(stdscr, title, content, config, x, width, height, panel
         panel = curses.panel.new_panel(win)
     else:
         win = panel.window()
+        # The terminal or the host column can change size while the panel is open
+        if win.getmaxyx() != (win_height, win_width):
+            win.resize(win_height, win_width)
+        if win.getbegyx() != (win_y, win_x):
+            panel.move(win_y, win_x)
         win.erase()
         win.box()
 
@@ -227,6 +499,54 @@ def render_search_panel(stdscr, title, config, panel=None):
 
     return panel
 
+def wait_for_input(stdscr, waitables, timeout=None) -> int:
+    """
+    Returns the next key, or -1 if one of `waitables` (anything with a fileno) became readable
+    or `timeout` seconds passed first. Keys curses has already buffered are returned right away.
+    """
+    stdscr.nodelay(True)
+    action = stdscr.getch()
+    if action != -1:
+        return action
+    select.select([sys.stdin, *waitables], [], [], timeout)
+    return stdscr.getch()
+
+class SignalPipe:
+    """
+    A pipe that becomes readable when `signum` arrives, so a select() loop can wait for it.
+    The interpreter writes the signal number to it (signal.set_wakeup_fd) before any Python code runs,
+    the handler itself does nothing, so the signal never waits for a lock the interrupted code holds.
+    """
+    def __init__(self, signum):
+        self.signum = signum
+        self.read_fd, self.write_fd = os.pipe()
+        os.set_blocking(self.read_fd, False)
+        os.set_blocking(self.write_fd, False)
+        signal.set_wakeup_fd(self.write_fd, warn_on_full_buffer=False)
+        signal.signal(signum, lambda signum, frame: None)
+
+    def fileno(self) -> int:
+        return self.read_fd
+
+    def empty(self) -> bool:
+        return not select.select([self.read_fd], [], [], 0)[0]
+
+    def drain(self) -> bool:
+        # Returns whether `signum` arrived, the pipe also gets the numbers of other signals with a handler
+        data = b''
+        try:
+            while chunk := os.read(self.read_fd, 4096):
+                data += chunk
+        except BlockingIOError:
+            pass
+        return self.signum in data
+
+    def close(self):
+        signal.signal(self.signum, signal.SIG_DFL)
+        signal.set_wakeup_fd(-1)
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
 def init_colors():
     fgcols = []
     curses.start_color()
@@ -256,13 +576,39 @@ class Theme:
         return fgcols
 
 # MARK: main
-def main(stdscr, args):
+def main(stdscr, args, profile):
+    profile.mark('curses')
     # Load configuration from .ssh-browse file
     with open(get_config_location(), 'r') as config_file:
         config = json.load(config_file)
 
     # Extract settings from the configuration
     ping_on_startup = config.get('ping_on_startup', 'default_value')
+    probe_concurrency = int(config.get('probe_concurrency', 64))
+    probe_timeout = float(config.get('probe_timeout', 5))
+    probe_mode = config.get('probe_mode', 'ssh')
+    probe_modes = config.get('probe_modes', {})
+    probe_socket_concurrency = int(config.get('probe_socket_concurrency', 512))
+    reachability_ttl = float(config.get('reachability_ttl', 600))
+    control_master = config.get('control_master', 'true')
+    control_persist = int(config.get('control_persist', 600))
+    control_pool_size = int(config.get('control_pool_size', 32))
+    exec_concurrency = int(config.get('exec_concurrency', 32))
+    exec_timeout = float(config.get('exec_timeout', 60))
+    monitor_on_startup = config.get('monitor', 'false')
+    monitor_interval = float(config.get('monitor_interval', 60))
+    monitor_max_interval = float(config.get('monitor_max_interval', 900))
+    monitor_jitter = float(config.get('monitor_jitter', 0.1))
+    # 0 means no limit, negative values too
+    monitor_rate = max(float(config.get('monitor_rate', 10)), 0)
+    status_daemon = config.get('status_daemon', 'true')
+    daemon_socket = config.get('daemon_socket', '')
+    daemon_max_age = float(config.get('daemon_max_age', 30))
+    reload_interval = float(config.get('reload_interval', 2))
+    dns_cache_enabled = config.get('dns_cache', 'true')
+    dns_ttl = float(config.get('dns_ttl', 300))
+    dns_negative_ttl = float(config.get('dns_negative_ttl', 60))
+    dns_workers = int(config.get('dns_workers', 16))
     theme = Theme(config.get('theme', 'plain_theme'))
     fgcols = theme.init_colors()
 
@@ -277,48 +623,39 @@ def main(stdscr, args):
     help_panel = None
     help_panel_visible = False
 
+    stats_panel = None
+    stats_panel_visible = False
+
     preview_panel = None
     preview_panel_visible = False
-    preview_content = []
+    preview_scroll = 0
+    preview_filename = None
+    # Wrapped notes of recently previewed hosts
+    notes_cache = ssh_notes.NotesCache()
 
     search_panel = None
     search_panel_visible = False
     search_filter = ''
+    fuzzy_search = config.get('search_mode', 'substring') == 'fuzzy'
+
+    command_panel = None
+    command_panel_visible = False
+    command_input = ''
+
+    exec_panel = None
+    exec_panel_visible = False
+    exec_job = None
+    exec_results = []
+    exec_lines = []
+    exec_scroll = 0
 
     notes_dir = config.get('notes_dir', '~/.ssh-browse/')
     notes_dir = os.path.expanduser(notes_dir)
 
-    if args.importJSON:
-        ssh_config_data = ssh_hosts.import_json_config(args.importJSON) 
-    else:
-        # Uses wsl2 compatible path as default
-        ssh_config_location = config.get('ssh_config_location', get_ssh_config_location())
-        ssh_config_data = ssh_hosts.read_ssh_config(ssh_config_location)
-
-    # Calculate the preferred column 1 length and set default column lengths
-    top_margin, col1_length, col2_length, spacer = 2, 10, 20, 10
-    for k in ssh_config_data.keys():
-        if len(k) + spacer > col1_length:
-            col1_length = len(k) + spacer
-
-    # Calculate the preferred column 2 length
-    preferrable_col2_length = 20
-    for k, v in ssh_config_data.items():
-        for prop, val in v.items():
-            if len(prop) > preferrable_col2_length:
-                preferrable_col2_length = len(prop)
-            if len(str(val)) > preferrable_col2_length:
-                preferrable_col2_length = len(str(val))
-
-    # Some wild calculations to make the columns fit the screen
-    categories = ssh_hosts.get_categories(ssh_config_data)
-    longest_category = max(len(category) for category in categories)
-    max_length = stdscr.getmaxyx()[1]
-    col2_length = min(preferrable_col2_length, max_length - longest_category - col1_length - spacer - 5)
-
+    # Setup the rendering configuration, the columns are widened to fit the hosts on screen
+    top_margin, spacer = 2, 10
     selected_host = 0
-    # Setup the rendering configuration
-    render_config = RenderConfig(col1_length, col2_length, spacer, top_margin, selected_host, {
+    render_config = RenderConfig(10, 20, spacer, top_margin, selected_host, {
         'COL_ACTIVE': fgcols['COL_ACTIVE'],
         'COL_INACTIVE': fgcols['COL_INACTIVE'],
         'COL_UNKNOWN': fgcols['COL_UNKNOWN'],
@@ -328,70 +665,405 @@ def main(stdscr, args):
         'COL_SELECTED_CATEGORY': fgcols['COL_SELECTED_CATEGORY'],
         'COL_CATOGORY': fgcols['COL_CATOGORY'],
         'COL_FOOTER': fgcols['COL_FOOTER'],
-        'COL_SELECTION': fgcols['COL_SELECTION']
+        'COL_SELECTION': fgcols['COL_SELECTION'],
+        # Themes from before the dns state don't have a color for it
+        'COL_DNS': fgcols.get('COL_DNS', fgcols['COL_INACTIVE'])
     })
 
+    # Something is on screen while the hosts are loaded
+    render_header(stdscr, render_config)
+    render_footer(stdscr, None, os.get_terminal_size(), render_config, 'Loading hosts...')
+    stdscr.refresh()
+    profile.mark('skeleton')
+
+    # The files the hosts are read from, watched for changes once the first frame is drawn
+    config_sources = ssh_hosts.ConfigSources()
+    if args.importJSON:
+        def show_progress(count):
+            render_footer(stdscr, None, os.get_terminal_size(), render_config, f'Loading hosts... {count}')
+            stdscr.refresh()
+        def load_hosts(sources, progress=None):
+            # Recorded before the export is read, so a change while it is read is noticed
+            sources.add_file(args.importJSON)
+            # Large exports are read as a stream, import_fields drops the keys that aren't listed
+            return ssh_hosts.import_json_config(args.importJSON, config.get('import_fields'), progress)
+        ssh_config_data = load_hosts(config_sources, show_progress)
+    else:
+        # Uses wsl2 compatible path as default
+        ssh_config_location = os.path.expanduser(config.get('ssh_config_location', get_ssh_config_location()))
+        def load_hosts(sources):
+            return ssh_hosts.load_ssh_config(ssh_config_location, get_ssh_config_cache_location(), sources)
+        ssh_config_data = load_hosts(config_sources)
+
+    profile.mark('hosts loaded')
+
+    # Notes are searched by word through an index that is kept up to date in the background
+    notes_index = ssh_notes.NotesIndex(notes_dir, get_notes_index_location()) if config.get('notes_index', 'true') == 'true' else None
+    search_index = ssh_search.SearchIndex(ssh_config_data, notes_dir, notes_index)
+
+    categories = ssh_hosts.get_categories(ssh_config_data)
+    longest_category = max(len(category) for category in categories)
+
     categories.insert(0, 'All')
     selected_category = 'All'
-    marked_hosts = []
-
-    if ping_on_startup == 'true':
-        ssh_hosts.check_reachable_all(ssh_config_data, False)
+    # Used as an ordered set, so hosts open in tmux in the order they were marked
+    marked_hosts = {}
+
+    # Show the last known state right away and only probe hosts whose result is stale
+    reachability_cache = ssh_cache.ReachabilityCache(get_reachability_cache_location(), reachability_ttl)
+    reachability_cache.load()
+    stale_hosts = {}
+    for hostname, hostconfig in ssh_config_data.items():
+        if restore_reachability(hostname, hostconfig, reachability_cache, ping_on_startup):
+            stale_hosts[hostname] = hostconfig
+
+    status_counter = StatusCounter(ssh_config_data)
+    profile.mark('reachability cache')
+
+    # Probing, the connection pool and the resize queue are started after the first frame
+    pool = None
+    dns_cache = None
+    resolver = None
+    probe_engine = None
+    resize_events = None
+    waitables = []
+    # Keeps probing hosts while monitoring is on, see ssh_monitor.MonitorScheduler
+    monitor = None
+    last_priorities = None
+    # Reads the hosts again when their files change, see ssh_reload.ConfigReloader
+    reloader = None
+    # Kept selected when the hosts are read again
+    reselect_host = None
+
+    # Created when windows are first opened, reports hosts that failed to connect
+    window_monitor = None
+    failed_hosts = []
+
+    # Only what changed is redrawn, and input blocks while no probes are running
+    dirty = DirtyState()
+    last_view = None
+    last_selected = None
+    footer_message = None
+    # Host that Enter was pressed on before its probe finished, it is connected to if the probe reaches it
+    connect_host = None
+    host_list = HostListView()
+    hosts = []
 
     while True:
-        hosts = get_hosts_to_display(ssh_config_data, selected_category, search_filter)
-        stdscr.erase()
-        size = os.get_terminal_size()
-        last_option = render_config.selected_host
+        if window_monitor is not None:
+            events = window_monitor.events.drain()
+            if events:
+                # Failures arriving before the next key press are shown together
+                failed_hosts += [host for host, status in events]
+                footer_message = f"Could not connect to {', '.join(failed_hosts)}"
+                dirty.footer = True
+
+        if exec_job is not None:
+            finished = exec_job.results.drain()
+            if finished:
+                # None marks the end of the job
+                exec_results += [result for result in finished if result is not None]
+                exec_lines = ssh_exec.format_results(exec_results)
+                dirty.selection = True
+
+        # Hosts read again after their files changed. Unchanged hosts keep their state, marks and place in the list
+        for changes in (reloader.results.drain() if reloader is not None else []):
+            reselect_host = host_list.selected_host()
+            for hostname in changes.removed:
+                status_counter.remove(ssh_config_data[hostname])
+                marked_hosts.pop(hostname, None)
+                if monitor is not None:
+                    monitor.remove(hostname)
+            changed = set(changes.changed)
+            reloaded = {}
+            probe_hosts = {}
+            for hostname, hostconfig in changes.hosts.items():
+                previous = ssh_config_data.get(hostname)
+                if previous is None:
+                    if restore_reachability(hostname, hostconfig, reachability_cache, ping_on_startup):
+                        probe_hosts[hostname] = hostconfig
+                    status_counter.add(hostconfig)
+                    if monitor is not None:
+                        monitor.add(hostname, time.monotonic())
+                elif hostname in changed:
+                    # Shows the last state until the host is probed with its new options
+                    hostconfig.reachability = previous.reachability
+                    hostconfig.latency = previous.latency
+                    if previous.reachable in ('yes', 'no', 'dns'):
+                        probe_hosts[hostname] = hostconfig
+                else:
+                    hostconfig = previous
+                reloaded[hostname] = hostconfig
+            # Updated in place, the dict is shared with the stats panel and the monitor's probes
+            ssh_config_data.clear()
+            ssh_config_data.update(reloaded)
+            search_index = changes.search_index
+            categories = ['All'] + list(search_index.categories)
+            longest_category = max(len(category) for category in categories)
+            if selected_category not in categories:
+                selected_category = 'All'
+            probe_engine.probe_all(probe_hosts)
+            footer_message = f"Reloaded hosts: {len(changes.added)} added, {len(changes.removed)} removed, {len(changes.changed)} changed"
+            dirty.full = True
+
+        # Apply probe results that finished since the last frame
+        probe_results = probe_engine.results.drain() if probe_engine is not None else []
+        for hostname, reachable, latency, failure in probe_results:
+            # Hosts removed by a reload may still finish their probe
+            if hostname not in ssh_config_data:
+                continue
+            if monitor is not None:
+                monitor.record(hostname, reachable, time.monotonic())
+            status_counter.set_state(ssh_config_data[hostname], reachable)
+            ssh_config_data[hostname].latency = latency
+            reachability_cache.update(hostname, reachable, latency, failure=failure)
+            dirty.rows.add(hostname)
+            dirty.footer = True
+            if host_list.selected_host() == hostname or stats_panel_visible:
+                dirty.selection = True
+        if connect_host in ssh_config_data and any(result[0] == connect_host for result in probe_results):
+            hostname, connect_host = connect_host, None
+            reachable = ssh_config_data[hostname].get('Reachable')
+            if reachable == 'yes':
+                exit_command = tmux_split.get_ssh_command(hostname, pool)
+                break
+            footer_message = get_unreachable_message(hostname, reachable)
+            dirty.footer = True
 
-        render_header(stdscr, render_config)
+        # Monitored hosts keep showing their last state until the new result arrives
+        if monitor is not None:
+            for hostname in monitor.due(time.monotonic()):
+                probe_engine.probe(hostname, ssh_config_data[hostname], monitor.get_max_age(hostname))
 
+        hosts = get_hosts_to_display(search_index, selected_category, search_filter, fuzzy_search)
+        size = os.get_terminal_size()
         max_lines = size.lines - top_margin - render_config.footer_height
-        scroll_pos = max(0, render_config.selected_host - max_lines + 1) if render_config.selected_host >= max_lines else 0
-        render_config.selected_host = min(render_config.selected_host, len(hosts) - 1)
-        if len(hosts) > 0:
-            render_hosts(stdscr, hosts[scroll_pos:], ssh_config_data, marked_hosts, scroll_pos, render_config)
-            render_properties(stdscr, ssh_config_data, hosts, render_config)
-            render_categories(stdscr, ssh_config_data, hosts, categories, selected_category, render_config)
-        render_footer(stdscr, ssh_config_data, size, render_config)
-        
-        if help_panel_visible:
-            title, content = get_help_text()
-            help_panel = render_help_panel(stdscr, title, content, render_config, help_panel)
+        host_list.update(hosts, max_lines)
+        if reselect_host is not None:
+            if reselect_host in ssh_config_data:
+                try:
+                    host_list.select(hosts.index(reselect_host))
+                except ValueError:
+                    pass
+            reselect_host = None
+        render_config.selected_host = host_list.selected
+        render_config.fit_columns(ssh_config_data, host_list.visible(), size.columns - longest_category - 5)
+
+        # Anything that moves rows around, widens a column or changes the panels redraws the whole screen
+        view = (id(hosts), host_list.scroll_pos, render_config.col1_length, render_config.col2_length, selected_category, size, help_panel_visible, stats_panel_visible, preview_panel_visible, search_panel_visible, search_filter, fuzzy_search, command_panel_visible, command_input, exec_panel_visible)
+        if view != last_view:
+            dirty.full = True
+        elif render_config.selected_host != last_selected:
+            dirty.selection = True
+            if last_selected is not None and last_selected < len(hosts):
+                dirty.rows.add(hosts[last_selected])
+            if len(hosts) > 0:
+                dirty.rows.add(host_list.selected_host())
+        last_view = view
+        last_selected = render_config.selected_host
+
+        # Waiting probes of the hosts on screen start first, then those of the current list
+        if probe_engine is not None and (id(hosts), host_list.scroll_pos, max_lines) != last_priorities:
+            probe_engine.prioritize(host_list.visible(), hosts)
+            last_priorities = (id(hosts), host_list.scroll_pos, max_lines)
+
+        if dirty.full:
+            stdscr.erase()
+            render_header(stdscr, render_config)
+            if len(hosts) > 0:
+                render_hosts(stdscr, host_list, ssh_config_data, marked_hosts, render_config, reachability_cache)
+                render_properties(stdscr, ssh_config_data, hosts, render_config, reachability_cache)
+                render_categories(stdscr, ssh_config_data, hosts, categories, selected_category, render_config)
+            render_footer(stdscr, status_counter, size, render_config, footer_message, monitor is not None)
         else:
-            if help_panel:
-                help_panel.hide()
-                help_panel = None
-        
-        if preview_panel_visible:
-            win_length = size.columns - col1_length - 4
-            win_height = size.lines - 4
-            preview_panel = render_preview_panel(stdscr, "Notes preview", preview_content, render_config, col1_length, win_length, win_height, preview_panel)
-        else:
-            if preview_panel:
-                preview_panel.hide()
-                preview_panel = None
+            if dirty.rows:
+                render_hosts(stdscr, host_list, ssh_config_data, marked_hosts, render_config, reachability_cache, dirty.rows)
+            if dirty.selection and len(hosts) > 0:
+                clear_properties(stdscr, render_config)
+                render_properties(stdscr, ssh_config_data, hosts, render_config, reachability_cache)
+                render_categories(stdscr, ssh_config_data, hosts, categories, selected_category, render_config)
+            if dirty.footer:
+                render_footer(stdscr, status_counter, size, render_config, footer_message, monitor is not None)
+
+        if dirty.full or dirty.selection:
+            if help_panel_visible:
+                title, content = get_help_text()
+                help_panel = render_help_panel(stdscr, title, content, render_config, help_panel)
+            else:
+                if help_panel:
+                    help_panel.hide()
+                    help_panel = None
 
-        if search_panel_visible:
-            search_panel = render_search_panel(stdscr, f"Search: {search_filter}", render_config, search_panel)
-        else:
-            if search_panel:
-                search_panel.hide()
-                search_panel = None
+            if stats_panel_visible:
+                title, content = get_stats_text(ssh_config_data, reachability_cache, categories)
+                stats_panel = render_help_panel(stdscr, title, content[:size.lines - 6], render_config, stats_panel)
+            else:
+                if stats_panel:
+                    stats_panel.hide()
+                    stats_panel = None
 
-        curses.panel.update_panels()
+            if preview_panel_visible:
+                win_length = size.columns - render_config.col1_length - 4
+                win_height = size.lines - 4
+                notes_filename = f'{notes_dir}{host_list.selected_host()}'
+                if notes_filename != preview_filename:
+                    # The notes of another host start at the top
+                    preview_filename = notes_filename
+                    preview_scroll = 0
+                preview_scroll, preview_content = get_preview_content(notes_cache, notes_filename, win_length - 4, preview_scroll, win_height - 4)
+                preview_title = f"Notes preview (line {preview_scroll + 1})" if preview_scroll else "Notes preview"
+                preview_panel = render_preview_panel(stdscr, preview_title, preview_content, render_config, render_config.col1_length, win_length, win_height, preview_panel)
+            else:
+                if preview_panel:
+                    preview_panel.hide()
+                    preview_panel = None
+
+            if search_panel_visible:
+                search_title = 'Fuzzy search' if fuzzy_search else 'Search'
+                search_panel = render_search_panel(stdscr, f"{search_title}: {search_filter}", render_config, search_panel)
+            else:
+                if search_panel:
+                    search_panel.hide()
+                    search_panel = None
+
+            if command_panel_visible:
+                command_title = f"Run on {len(marked_hosts) or 1} host{'s' if len(marked_hosts) > 1 else ''}"
+                command_panel = render_search_panel(stdscr, f"{command_title}: {command_input}", render_config, command_panel)
+            else:
+                if command_panel:
+                    command_panel.hide()
+                    command_panel = None
+
+            if exec_panel_visible:
+                running = '' if exec_job.done else ', running'
+                exec_title = f"{exec_job.command} ({len(exec_results)}/{len(exec_job.hostnames)} hosts{running})"[:size.columns - 8]
+                exec_panel = render_preview_panel(stdscr, exec_title, exec_lines[exec_scroll:], render_config, 2, size.columns - 4, size.lines - 4, exec_panel)
+            else:
+                if exec_panel:
+                    exec_panel.hide()
+                    exec_panel = None
 
-        # Refresh the screen
+        # Panels are refreshed after stdscr (the bottom of the panel stack), then the terminal is updated once
         stdscr.move(0, 0)
-        stdscr.refresh()
+        curses.panel.update_panels()
+        curses.doupdate()
+        dirty.clear()
+
+        if probe_engine is None:
+            profile.mark('first frame')
+            # Only needed once hosts are on screen, importing them (and asyncio) takes longer than loading the hosts
+            import subprocess
+            import threading
+            import ssh_probe
+            import ssh_pool
+            import ssh_exec
+            import ssh_daemon
+            import ssh_dns
+            import ssh_monitor
+            import ssh_reload
+            import tmux_split
+
+            # Connections to a host share a master connection, started when a probe reaches the host
+            pool = ssh_pool.ControlPool(get_control_path_location(), control_persist, control_pool_size) if control_master == 'true' else None
+            # HostNames are resolved on a few threads instead of in every probe, and cached across restarts
+            if dns_cache_enabled == 'true':
+                dns_cache = ssh_dns.DNSCache(get_dns_cache_location(), dns_ttl, dns_negative_ttl)
+                dns_cache.load()
+                resolver = ssh_dns.Resolver(dns_cache, dns_workers)
+            def start_probe_engine(results=None):
+                return ssh_probe.ProbeEngine(probe_concurrency, probe_timeout, probe_mode, probe_modes, probe_socket_concurrency, pool, results, resolver)
+            # A running status daemon probes for every ssh-browse instance, otherwise probes run in this one
+            if status_daemon == 'true':
+                probe_engine = ssh_daemon.DaemonClient.connect(daemon_socket or ssh_daemon.get_daemon_socket_location(), start_probe_engine, daemon_max_age)
+            if probe_engine is None:
+                probe_engine = start_probe_engine()
+                if resolver is not None:
+                    # Every HostName is resolved up front, behind the names probes are waiting for.
+                    # Proxied hosts are resolved by their jump host
+                    def prefetch(hostconfigs):
+                        targets = [ssh_probe.get_probe_target(hostname, hostconfig) for hostname, hostconfig in hostconfigs]
+                        resolver.prefetch(target.address for target in targets if not target.is_proxied())
+                    threading.Thread(target=prefetch, args=(list(ssh_config_data.items()),), daemon=True).start()
+            probe_engine.prioritize(host_list.visible(), hosts)
+            last_priorities = (id(hosts), host_list.scroll_pos, max_lines)
+            probe_engine.probe_all(stale_hosts)
+
+            # Resizing the terminal interrupts the wait for input through this pipe
+            resize_events = SignalPipe(signal.SIGWINCH)
+            waitables = [probe_engine.results, resize_events]
+            if reload_interval > 0:
+                reloader = ssh_reload.ConfigReloader(load_hosts, ssh_config_data, config_sources, search_index, notes_dir, notes_index, reload_interval)
+                waitables.append(reloader.results)
+            if monitor_on_startup == 'true':
+                monitor = ssh_monitor.MonitorScheduler(monitor_interval, monitor_max_interval, monitor_jitter, monitor_rate)
+                for hostname in ssh_config_data:
+                    monitor.add(hostname, time.monotonic())
+                dirty.footer = True
+            profile.mark('probes started')
+            if args.profile_startup:
+                break
 
-        stdscr.timeout(500)
-        action = stdscr.getch()
+        # Sleep until a key is pressed, a probe finishes or the terminal is resized,
+        # waking up once a minute to refresh the ages of probe results, or when the monitor has hosts to probe
+        timeout = 60
+        if monitor is not None:
+            next_due = monitor.next_due(time.monotonic())
+            if next_due is not None:
+                timeout = min(timeout, next_due)
+        if search_index.ranking is not None:
+            # Shows the fuzzy ranking soon after the background thread is done with it
+            timeout = min(timeout, 0.02)
+        action = wait_for_input(stdscr, waitables, timeout)
+
+        if action == -1:
+            if resize_events.drain():
+                size = os.get_terminal_size()
+                curses.resizeterm(size.lines, size.columns)
+                dirty.full = True
+            elif all(waitable.empty() for waitable in waitables):
+                dirty.rows.update(host_list.visible())
+            continue
+        if action == curses.KEY_RESIZE:
+            dirty.full = True
+        if footer_message:
+            footer_message = None
+            failed_hosts = []
+            # Any other key cancels waiting to connect
+            connect_host = None
+            dirty.footer = True
+
+        # The results panel takes all keys while it is open
+        if exec_panel_visible:
+            page = size.lines - 8
+            if action == curses.KEY_UP:
+                exec_scroll = max(exec_scroll - 1, 0)
+            elif action == curses.KEY_DOWN:
+                exec_scroll = min(exec_scroll + 1, max(len(exec_lines) - 1, 0))
+            elif action == curses.KEY_PPAGE:
+                exec_scroll = max(exec_scroll - page, 0)
+            elif action == curses.KEY_NPAGE:
+                exec_scroll = min(exec_scroll + page, max(len(exec_lines) - 1, 0))
+            elif action in (curses.ascii.ESC, ord('x'), ord('q')):
+                # Closing the panel also stops the command on hosts that are still running it
+                exec_panel_visible = False
+                exec_job.cancel()
+                waitables.remove(exec_job.results)
+                exec_job = None
+            dirty.selection = True
+            continue
 
         if action == curses.KEY_UP:
-            render_config.selected_host = max(render_config.selected_host - 1, 0)
+            host_list.move(-1)
         elif action == curses.KEY_DOWN:
-            render_config.selected_host = min(render_config.selected_host + 1, len(hosts) - 1)
+            host_list.move(1)
+        elif action == curses.KEY_PPAGE:
+            host_list.page_up()
+        elif action == curses.KEY_NPAGE:
+            host_list.page_down()
+        elif action == curses.KEY_HOME:
+            host_list.home()
+        elif action == curses.KEY_END:
+            host_list.end()
         elif action == curses.KEY_RIGHT:
             category_index = categories.index(selected_category)
             selected_category = categories[(category_index + 1) % len(categories)]
@@ -410,59 +1082,113 @@ def main(stdscr, args):
             elif action == curses.ascii.ESC:
                 search_filter = ''
                 search_panel_visible = False
+            elif action == ord('\t'):
+                fuzzy_search = not fuzzy_search
             elif action >= 32 and action <= 126:
                 search_filter += chr(action)
-            hosts = get_hosts_to_display(ssh_config_data, selected_category, search_filter)
+            continue
+
+        # Handle command input if command panel is visible
+        if command_panel_visible:
+            if action == curses.KEY_BACKSPACE:
+                if len(command_input) == 0:
+                    command_panel_visible = False
+                command_input = command_input[:-1]
+            elif action == curses.KEY_ENTER or action == ord('\n'):
+                command_panel_visible = False
+                if command_input and len(hosts) > 0:
+                    # Runs on the marked hosts, or the selected host if none are marked
+                    targets = list(marked_hosts) or [host_list.selected_host()]
+                    exec_job = ssh_exec.ExecJob(targets, command_input, exec_concurrency, exec_timeout, pool)
+                    waitables.append(exec_job.results)
+                    exec_results = []
+                    exec_lines = []
+                    exec_scroll = 0
+                    exec_panel_visible = True
+                    marked_hosts = {}
+            elif action == curses.ascii.ESC:
+                command_input = ''
+                command_panel_visible = False
+            elif action >= 32 and action <= 126:
+                command_input += chr(action)
             continue
 
         if action == ord(' '):
-            hostname = hosts[render_config.selected_host]
+            hostname = host_list.selected_host()
             if ssh_config_data[hostname].get('Reachable') != 'pinging':
                 if hostname in marked_hosts:
-                    marked_hosts.remove(hostname)
+                    del marked_hosts[hostname]
                 else:
-                    marked_hosts.append(hostname)
+                    marked_hosts[hostname] = True
+                dirty.rows.add(hostname)
         elif action == ord("\n"):
-            hostname = hosts[render_config.selected_host]
-            if ssh_config_data[hostname].get('Reachable') == 'unknown':
-                ssh_config_data[hostname]['Reachable'] = 'pinging'
-                ssh_hosts.check_reachable(ssh_config_data[hostname])
-            if ssh_config_data[hostname].get('Reachable') == 'yes':
-                exit_command = f'ssh {hostname}'
+            hostname = host_list.selected_host()
+            reachable = ssh_config_data[hostname].get('Reachable')
+            if reachable in ('unknown', 'pinging'):
+                # Probed by the engine like any other host, so the UI keeps responding meanwhile
+                if reachable == 'unknown':
+                    status_counter.set_state(ssh_config_data[hostname], 'pinging')
+                    probe_engine.probe(hostname, ssh_config_data[hostname])
+                probe_engine.prioritize([hostname, *host_list.visible()])
+                connect_host = hostname
+                footer_message = f"Probing {hostname}, connecting once it answers (any key cancels)"
+            elif reachable == 'yes':
+                exit_command = tmux_split.get_ssh_command(hostname, pool)
                 break
             else:
-                stdscr.addstr(size.lines - 1, 1, f"Host {hostname} is not reachable", render_config.color['COL_FOOTER'])
+                footer_message = get_unreachable_message(hostname, reachable)
+            dirty.rows.add(hostname)
+            dirty.selection = True
+            dirty.footer = True
         elif action >= ord('1') and action <= ord('9'):
             selected_category = categories[action - ord('1')]
         elif action == ord('t'):
-            tmux_split.open_ssh_hosts(marked_hosts)
-            marked_hosts = []
+            tmux_split.open_ssh_hosts(list(marked_hosts), pool)
+            marked_hosts = {}
+            dirty.full = True
         elif action == ord('w'):
-            tmux_split.open_nested_tmux_windows(marked_hosts)
-            marked_hosts = []
+            if window_monitor is None:
+                window_monitor = tmux_split.WindowMonitor(get_window_monitor_location())
+                waitables.append(window_monitor.events)
+            tmux_split.open_nested_tmux_windows(list(marked_hosts), window_monitor, pool)
+            marked_hosts = {}
+            dirty.full = True
+        elif action == ord('x'):
+            command_panel_visible = True
         elif action == ord('d'):
             tmux_split.demo()
         elif action == ord('a'):
-            visible_hosts = get_hosts_to_display(ssh_config_data, selected_category, search_filter)
+            visible_hosts = get_hosts_to_display(search_index, selected_category, search_filter, fuzzy_search)
             for hostname in visible_hosts:
-                ssh_config_data[hostname]['Reachable'] = 'pinging'
-            ssh_hosts.check_reachable_all({hostname: ssh_config_data[hostname] for hostname in visible_hosts}, False)
+                status_counter.set_state(ssh_config_data[hostname], 'pinging')
+            probe_engine.probe_all({hostname: ssh_config_data[hostname] for hostname in visible_hosts})
+            dirty.full = True
         elif action == ord('p'):
-            selected_host = hosts[render_config.selected_host]
-            if selected_host not in marked_hosts:
-                marked_hosts.append(selected_host)
+            selected_host = host_list.selected_host()
+            marked_hosts[selected_host] = True
             filtered_hosts = {hostname: ssh_config_data[hostname] for hostname in marked_hosts}
             for hostname in filtered_hosts:
-                ssh_config_data[hostname]['Reachable'] = 'pinging'
-            ssh_hosts.check_reachable_all(filtered_hosts, False)
+                status_counter.set_state(ssh_config_data[hostname], 'pinging')
+            probe_engine.probe_all(filtered_hosts)
             marked_hosts.clear()
+            dirty.full = True
 
+        elif action == ord('m'):
+            if monitor is None:
+                monitor = ssh_monitor.MonitorScheduler(monitor_interval, monitor_max_interval, monitor_jitter, monitor_rate)
+                for hostname in ssh_config_data:
+                    monitor.add(hostname, time.monotonic())
+            else:
+                monitor = None
+            dirty.footer = True
         elif action == ord('h'):
             help_panel_visible = not help_panel_visible
+        elif action == ord('i'):
+            stats_panel_visible = not stats_panel_visible
         elif action == ord('s'):
             search_panel_visible = not search_panel_visible            
         elif action == ord('e'):
-            hostname = hosts[render_config.selected_host]
+            hostname = host_list.selected_host()
             editor = os.environ.get('EDITOR')
             exit_command = f'{editor} {notes_dir}{hostname}'
             subprocess.run(exit_command, shell=True)
@@ -470,18 +1196,31 @@ def main(stdscr, args):
             break
         elif action == ord('n'):
             preview_panel_visible = not preview_panel_visible
-            if preview_panel_visible:
-                hostname = hosts[render_config.selected_host]
-                preview_content = get_preview_content(f'{notes_dir}{hostname}')
+            preview_filename = None
+        elif action == ord('[') and preview_panel_visible:
+            preview_scroll = max(preview_scroll - (size.lines - 8), 0)
+            dirty.selection = True
+        elif action == ord(']') and preview_panel_visible:
+            # Moved back by get_preview_content when this is past the end of the notes
+            preview_scroll += size.lines - 8
+            dirty.selection = True
         elif action == ord('q'):
             break
-        if render_config.selected_host != last_option:
-            if preview_panel_visible:
-                hostname = hosts[render_config.selected_host]
-                preview_content = get_preview_content(f'{notes_dir}{hostname}')
-                preview_panel = None
 
     # Cleanup    
+    resize_events.close()
+    if window_monitor is not None:
+        window_monitor.stop()
+    if exec_job is not None:
+        exec_job.cancel()
+    if reloader is not None:
+        reloader.stop()
+    probe_engine.stop()
+    if resolver is not None:
+        resolver.stop()
+        dns_cache.save()
+    # Also keeps the probe results when ssh-browse is restarted after editing notes
+    reachability_cache.save()
     stdscr.keypad(0)
     curses.curs_set(1)
     curses.echo()
@@ -496,7 +1235,12 @@ def get_current_version():
 if __name__ == "__main__":
     msg = 'SSH Browse'
     parser = argparse.ArgumentParser()
-    parser.add_argument('-i', '--importJSON', help='Import hosts from JSON file')
+    parser.add_argument('-i', '--importJSON', help='Import hosts from a JSON or NDJSON file')
     parser.add_argument('-v', '--version', action='version', version=f'{msg} {get_current_version()}')
+    parser.add_argument('--profile-startup', action='store_true', help='Quit after the first frame and print how long each startup stage took')
     args = parser.parse_args()
-    curses.wrapper(main, args)
+    profile = StartupProfile(STARTED)
+    profile.mark('imports')
+    curses.wrapper(main, args, profile)
+    if args.profile_startup:
+        print(profile.report(), file=sys.stderr)
@@ -0,0 +1,101 @@
+import os
+import json
+import math
+import time
+
+def write_atomic(filename, write, binary=False):
+    """
+    Calls `write(file)` on a temporary file next to `filename`, then moves it in place,
+    so a crash never leaves a truncated file behind. Each call gets a temporary file of its own,
+    since several instances and the status daemon may save the same file at once.
+    """
+    # Imported here, it is only needed when saving and not on the way to the first frame
+    import tempfile
+    directory = os.path.dirname(filename)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_filename = tempfile.mkstemp(prefix=f'{os.path.basename(filename)}.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb' if binary else 'w') as file:
+            write(file)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        try:
+            os.unlink(tmp_filename)
+        except OSError:
+            pass
+        raise
+
+def write_json_atomic(filename, data):
+    write_atomic(filename, lambda file: json.dump(data, file, separators=(',', ':')))
+
+def percentile(values, fraction):
+    # Nearest rank percentile of sorted `values`, None if there are none
+    if not values:
+        return None
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+class ReachabilityEntry:
+    __slots__ = ('reachable', 'timestamp', 'latency', 'failure')
+
+    def __init__(self, reachable, timestamp, latency=None, failure=None):
+        self.reachable = reachable
+        self.timestamp = timestamp
+        self.latency = latency
+        self.failure = failure
+
+class ReachabilityCache:
+    """
+    Last known probe result for each host, persisted as JSON in `filename`.
+    Entries older than `ttl` seconds are stale and should be probed again,
+    but are still shown as the last known state until a new result arrives.
+    Each entry is stored as [reachable, timestamp, latency, failure].
+    """
+    def __init__(self, filename, ttl=600):
+        self.filename = filename
+        self.ttl = ttl
+        self.entries = {}
+
+    def load(self):
+        try:
+            with open(self.filename, 'r') as file:
+                data = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return
+        if not isinstance(data, dict):
+            return
+        # Files written before failures were recorded have three values per entry
+        for hostname, values in data.items():
+            if not isinstance(values, list):
+                continue
+            try:
+                entry = ReachabilityEntry(*values)
+            except TypeError:
+                # Not an entry this version wrote, the host is probed again
+                continue
+            if isinstance(entry.timestamp, (int, float)):
+                self.entries[hostname] = entry
+
+    def save(self):
+        data = {hostname: [e.reachable, e.timestamp, e.latency, e.failure] for hostname, e in self.entries.items()}
+        try:
+            write_json_atomic(self.filename, data)
+        except OSError:
+            pass
+
+    def get(self, hostname):
+        return self.entries.get(hostname)
+
+    def update(self, hostname, reachable, latency=None, timestamp=None, failure=None):
+        if timestamp is None:
+            timestamp = time.time()
+        self.entries[hostname] = ReachabilityEntry(reachable, timestamp, latency, failure)
+
+    def age(self, hostname, now=None):
+        entry = self.entries.get(hostname)
+        if entry is None:
+            return None
+        return (now or time.time()) - entry.timestamp
+
+    def is_stale(self, hostname, now=None) -> bool:
+        age = self.age(hostname, now)
+        return age is None or age > self.ttl
@@ -0,0 +1,381 @@
+import os
+import grp
+import pwd
+import json
+import time
+import signal
+import socket
+import struct
+import asyncio
+import threading
+import ssh_dns
+import ssh_cache
+import ssh_hosts
+import ssh_probe
+
+# Hosts per probe message, so no line gets longer than the reader's limit
+PROBE_BATCH_SIZE = 200
+LINE_LIMIT = 1 << 20
+
+def get_daemon_socket_location():
+    id = os.getuid()
+    user = pwd.getpwuid(id).pw_name
+    return f'/home/{user}/.ssh-browse/daemon.sock'
+
+def get_daemon_cache_location():
+    # Not reachability.json, which every ssh-browse instance writes when it quits
+    id = os.getuid()
+    user = pwd.getpwuid(id).pw_name
+    return f'/home/{user}/.ssh-browse/daemon-reachability.json'
+
+def get_daemon_dns_cache_location():
+    id = os.getuid()
+    user = pwd.getpwuid(id).pw_name
+    return f'/home/{user}/.ssh-browse/daemon-dns.json'
+
+def get_daemon_ssh_config_cache_location():
+    # Not the cache of ssh-browse, which an instance may be writing at the same time
+    id = os.getuid()
+    user = pwd.getpwuid(id).pw_name
+    return f'/home/{user}/.ssh-browse/daemon-ssh_config.cache'
+
+def get_config_location():
+    id = os.getuid()
+    user = pwd.getpwuid(id).pw_name
+    return f'/home/{user}/.ssh-browse/config.json'
+
+def get_ssh_config_location():
+    id = os.getuid()
+    user = pwd.getpwuid(id).pw_name
+    return f'/home/{user}/.ssh/config'
+
+def encode(message) -> bytes:
+    return json.dumps(message, separators=(',', ':')).encode() + b'\n'
+
+def is_allowed_peer(sock, group=None) -> bool:
+    """
+    Whether the process at the other end of `sock` runs as the daemon's user, or as a member of `group`
+    (a grp.struct_group). Where SO_PEERCRED isn't available the socket's permissions decide alone.
+    """
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return True
+    credentials = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    _, uid, gid = struct.unpack('3i', credentials)
+    if uid == os.getuid():
+        return True
+    if group is None:
+        return False
+    try:
+        user = pwd.getpwuid(uid)
+    except KeyError:
+        return False
+    return gid == group.gr_gid or user.pw_gid == group.gr_gid or user.pw_name in group.gr_mem
+
+def is_daemon_running(path) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+            return True
+        except OSError:
+            return False
+
+class StatusDaemon:
+    """
+    Probes hosts for the ssh-browse instances connected to the Unix socket at `path`,
+    and pushes each result to every instance that asked about the host, so instances
+    share probes instead of each probing the fleet. The protocol is one JSON array per line:
+        ["probe", max_age, [name, ...]]  from an instance, probes the hosts
+            unless the daemon has a result younger than max_age seconds, which is sent right away
+        ["prioritize", [name, ...]]  from an instance, the hosts on its screen
+        ["r", name, reachable, latency, failure]  from the daemon, a probe result
+        ["unknown", [name, ...]]  from the daemon, hosts it doesn't have, which the instance probes itself
+    Instances only send names: how a host is probed comes from the daemon's own hosts, read by
+    `load(sources)` and read again every `reload_interval` seconds when their files changed,
+    so a client can't have the daemon run a ProxyCommand of its choosing.
+    Only the daemon's user and the members of `group` (a grp.struct_group) may connect.
+    """
+    def __init__(self, path, engine, cache, load, dns_cache=None, group=None, save_interval=60, reload_interval=2):
+        self.path = path
+        self.engine = engine
+        self.cache = cache
+        self.load = load
+        self.dns_cache = dns_cache
+        self.group = group
+        self.save_interval = save_interval
+        self.reload_interval = reload_interval
+        self.sources = ssh_hosts.ConfigSources()
+        self.hosts = {}
+        # writer -> names of the hosts the instance asked about
+        self.clients = {}
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        # SIGTERM exits like Ctrl-C does
+        loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        try:
+            self.hosts = await loop.run_in_executor(None, self.load, self.sources)
+        except (OSError, ValueError, KeyError, AttributeError):
+            # Without hosts of its own every instance probes by itself, until the config can be read
+            pass
+        # Left behind by a daemon that didn't exit cleanly
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        # Created without permissions for others, so there is no moment anyone else can connect
+        umask = os.umask(0o177)
+        try:
+            await asyncio.start_unix_server(self.handle, self.path, limit=LINE_LIMIT)
+        finally:
+            os.umask(umask)
+        if self.group is not None:
+            os.chown(self.path, -1, self.group.gr_gid)
+            os.chmod(self.path, 0o660)
+        loop.add_reader(self.engine.results.fileno(), self.publish)
+        if self.reload_interval > 0:
+            asyncio.create_task(self.reload())
+        while True:
+            await asyncio.sleep(self.save_interval)
+            self.cache.save()
+            if self.dns_cache is not None:
+                self.dns_cache.save()
+
+    async def reload(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            if await loop.run_in_executor(None, self.sources.is_current):
+                continue
+            sources = ssh_hosts.ConfigSources()
+            try:
+                hosts = await loop.run_in_executor(None, self.load, sources)
+            except (OSError, ValueError, KeyError, AttributeError):
+                # A file that is still being written, it is read again on the next check
+                continue
+            self.sources = sources
+            # An empty file is more likely saved halfway than meant to remove every host
+            if hosts:
+                self.hosts = hosts
+
+    async def handle(self, reader, writer):
+        if not is_allowed_peer(writer.get_extra_info('socket'), self.group):
+            writer.close()
+            return
+        interest = set()
+        self.clients[writer] = interest
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                if message[0] == 'probe':
+                    self.probe(writer, interest, message[1], message[2])
+                elif message[0] == 'prioritize':
+                    self.engine.prioritize(message[1])
+        except (ValueError, IndexError, TypeError, ConnectionError):
+            # A broken message or client, the client falls back to probing on its own
+            pass
+        except asyncio.CancelledError:
+            # The daemon is exiting
+            pass
+        finally:
+            del self.clients[writer]
+            writer.close()
+
+    def probe(self, writer, interest, max_age, names):
+        now = time.time()
+        queue = {}
+        unknown = []
+        for name in names:
+            hostconfig = self.hosts.get(name)
+            if hostconfig is None:
+                unknown.append(name)
+                continue
+            interest.add(name)
+            entry = self.cache.get(name)
+            if entry is not None and now - entry.timestamp <= max_age:
+                writer.write(encode(['r', name, entry.reachable, entry.latency, entry.failure]))
+            else:
+                queue[name] = hostconfig
+        if unknown:
+            writer.write(encode(['unknown', unknown]))
+        # Hosts that are already being probed for another instance aren't probed twice
+        self.engine.probe_all(queue)
+
+    def publish(self):
+        for name, reachable, latency, failure in self.engine.results.drain():
+            self.cache.update(name, reachable, latency, failure=failure)
+            line = encode(['r', name, reachable, latency, failure])
+            for writer, interest in self.clients.items():
+                if name in interest:
+                    writer.write(line)
+
+def run_daemon(path=None):
+    """
+    Runs a StatusDaemon until it is interrupted or terminated (SIGTERM), with the probe settings
+    and the ssh config of config.json. Returns False if a daemon is already listening on `path`,
+    raises ValueError if `daemon_group` isn't a group.
+    """
+    try:
+        with open(get_config_location(), 'r') as config_file:
+            config = json.load(config_file)
+    except (OSError, ValueError):
+        config = {}
+    path = path or config.get('daemon_socket') or get_daemon_socket_location()
+    path = os.path.expanduser(path)
+    if is_daemon_running(path):
+        return False
+    group = None
+    if config.get('daemon_group'):
+        try:
+            group = grp.getgrnam(config['daemon_group'])
+        except KeyError:
+            raise ValueError(f"Unknown daemon_group {config['daemon_group']!r}")
+
+    ssh_config_location = os.path.expanduser(config.get('ssh_config_location', get_ssh_config_location()))
+    def load_hosts(sources):
+        return ssh_hosts.load_ssh_config(ssh_config_location, get_daemon_ssh_config_cache_location(), sources)
+
+    dns_cache = ssh_dns.DNSCache(get_daemon_dns_cache_location(), float(config.get('dns_ttl', 300)), float(config.get('dns_negative_ttl', 60)))
+    dns_cache.load()
+    resolver = ssh_dns.Resolver(dns_cache, int(config.get('dns_workers', 16))) if config.get('dns_cache', 'true') == 'true' else None
+    engine = ssh_probe.ProbeEngine(
+        int(config.get('probe_concurrency', 64)),
+        float(config.get('probe_timeout', 5)),
+        config.get('probe_mode', 'ssh'),
+        config.get('probe_modes', {}),
+        int(config.get('probe_socket_concurrency', 512)),
+        resolver=resolver)
+    cache = ssh_cache.ReachabilityCache(get_daemon_cache_location(), float(config.get('reachability_ttl', 600)))
+    cache.load()
+    daemon = StatusDaemon(path, engine, cache, load_hosts, dns_cache, group, reload_interval=float(config.get('reload_interval', 2)))
+
+    try:
+        asyncio.run(daemon.serve())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        engine.stop()
+        if resolver is not None:
+            resolver.stop()
+        cache.save()
+        dns_cache.save()
+        if os.path.exists(path):
+            os.unlink(path)
+    return True
+
+class DaemonClient:
+    """
+    Has the interface of ssh_probe.ProbeEngine, but sends probes to a StatusDaemon,
+    and puts the results the daemon pushes on `results`.
+    If the daemon goes away, the hosts still waiting for a result and all later probes
+    go to the in-process ProbeEngine returned by `fallback(results)`. So do the hosts the daemon
+    doesn't have (e.g. hosts imported from JSON), while the daemon keeps probing the others.
+    """
+    def __init__(self, sock, fallback, max_age=30):
+        self.socket = sock
+        self.fallback = fallback
+        self.max_age = max_age
+        self.results = ssh_probe.WakeupQueue()
+        self.lock = threading.Lock()
+        # name -> hostconfig of the hosts waiting for a result, probed again by the fallback engine
+        self.queued = {}
+        self.engine = None
+        # The fallback engine for the hosts the daemon doesn't have, created when it reports the first
+        self.local = None
+        self.stopping = False
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def connect(cls, path, fallback, max_age=30):
+        # Returns None if no daemon is listening on `path`
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(os.path.expanduser(path))
+        except OSError:
+            sock.close()
+            return None
+        return cls(sock, fallback, max_age)
+
+    def _read(self):
+        with self.socket.makefile('rb') as file:
+            try:
+                for line in file:
+                    message = json.loads(line)
+                    if message[0] == 'unknown':
+                        self._probe_locally(message[1])
+                        continue
+                    _, name, reachable, latency, failure = message
+                    with self.lock:
+                        self.queued.pop(name, None)
+                    self.results.put((name, reachable, latency, failure))
+            except (OSError, ValueError):
+                pass
+        if self.stopping:
+            return
+        # The daemon is gone
+        with self.lock:
+            self.engine = self.local or self.fallback(self.results)
+            queued, self.queued = self.queued, {}
+        self.engine.probe_all(queued)
+
+    def _probe_locally(self, names):
+        with self.lock:
+            hosts = {name: self.queued.pop(name) for name in names if name in self.queued}
+            if self.local is None:
+                self.local = self.fallback(self.results)
+            local = self.local
+        local.probe_all(hosts)
+
+    def _send(self, message):
+        try:
+            self.socket.sendall(encode(message))
+        except OSError:
+            # The reader notices too, and hands the waiting hosts to the fallback engine
+            pass
+
+    def probe(self, hostname, hostconfig, max_age=None) -> bool:
+        return self.probe_all({hostname: hostconfig}, max_age) == 1
+
+    def probe_all(self, ssh_config_data, max_age=None) -> int:
+        # A result the daemon already has is used if it is at most `max_age` seconds old (or the client's max_age)
+        names = []
+        with self.lock:
+            engine = self.engine
+            if engine is None:
+                for hostname, hostconfig in ssh_config_data.items():
+                    if hostname not in self.queued:
+                        self.queued[hostname] = hostconfig
+                        names.append(hostname)
+        if engine is not None:
+            return engine.probe_all(ssh_config_data)
+        max_age = self.max_age if max_age is None else min(max_age, self.max_age)
+        for i in range(0, len(names), PROBE_BATCH_SIZE):
+            self._send(['probe', max_age, names[i:i + PROBE_BATCH_SIZE]])
+        return len(names)
+
+    def prioritize(self, viewport, preferred=None):
+        with self.lock:
+            engine = self.engine
+            local = self.local
+        if engine is not None:
+            engine.prioritize(viewport, preferred)
+        else:
+            self._send(['prioritize', list(viewport)])
+            if local is not None:
+                local.prioritize(viewport, preferred)
+
+    def stop(self):
+        self.stopping = True
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.thread.join()
+        self.socket.close()
+        engine = self.engine or self.local
+        if engine is not None:
+            # Closes the results queue, which the engine shares
+            engine.stop()
+        else:
+            self.results.close()
@@ -0,0 +1,165 @@
+import json
+import time
+import socket
+import ipaddress
+import threading
+import collections
+import concurrent.futures
+import ssh_cache
+
+def is_address(name) -> bool:
+    # IP literals don't need resolving
+    try:
+        ipaddress.ip_address(name)
+        return True
+    except ValueError:
+        return False
+
+# getaddrinfo errors that mean the name has no address, any other error may be gone on the next try
+NO_ADDRESS_ERRORS = {socket.EAI_NONAME, getattr(socket, 'EAI_NODATA', socket.EAI_NONAME)}
+
+def get_addresses(name):
+    """
+    Addresses of `name` in the order getaddrinfo prefers them, an empty list if it doesn't resolve,
+    or None if resolving failed for now (e.g. EAI_AGAIN, the resolver didn't answer).
+    """
+    try:
+        infos = socket.getaddrinfo(name, None, type=socket.SOCK_STREAM)
+    except UnicodeError:
+        # Not a valid name
+        return []
+    except socket.gaierror as e:
+        return [] if e.errno in NO_ADDRESS_ERRORS else None
+    except OSError:
+        return None
+    addresses = []
+    for _, _, _, _, sockaddr in infos:
+        if sockaddr[0] not in addresses:
+            addresses.append(sockaddr[0])
+    return addresses
+
+class DNSEntry:
+    __slots__ = ('addresses', 'timestamp')
+
+    def __init__(self, addresses, timestamp):
+        self.addresses = addresses
+        self.timestamp = timestamp
+
+class DNSCache:
+    """
+    Addresses of each HostName, persisted as JSON in `filename`.
+    Entries are used for `ttl` seconds, names that didn't resolve (no addresses) for
+    `negative_ttl` seconds, so a record that was just added is picked up soon.
+    Each entry is stored as [addresses, timestamp].
+    """
+    def __init__(self, filename, ttl=300, negative_ttl=60):
+        self.filename = filename
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = {}
+
+    def load(self):
+        try:
+            with open(self.filename, 'r') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return
+        for name, (addresses, timestamp) in data.items():
+            self.entries[name] = DNSEntry(addresses, timestamp)
+
+    def save(self):
+        # Copied first, the resolver threads may add entries meanwhile
+        data = {name: [e.addresses, e.timestamp] for name, e in list(self.entries.items())}
+        try:
+            ssh_cache.write_json_atomic(self.filename, data)
+        except OSError:
+            pass
+
+    def get(self, name, now=None):
+        # Returns the entry of `name`, or None if there is none or it expired
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        ttl = self.ttl if entry.addresses else self.negative_ttl
+        return entry if (now or time.time()) - entry.timestamp <= ttl else None
+
+    def update(self, name, addresses, timestamp=None):
+        self.entries[name] = DNSEntry(addresses, time.time() if timestamp is None else timestamp)
+
+class Resolver:
+    """
+    Resolves HostNames with getaddrinfo on up to `workers` threads and keeps the results in a DNSCache.
+    resolve() returns a concurrent.futures.Future of the addresses of a name (empty if it didn't resolve,
+    None if resolving failed for now, which isn't cached), which is already done for names in the cache and IP literals.
+    Names a probe is waiting for are resolved before those queued by prefetch().
+    """
+    def __init__(self, cache, workers=16):
+        self.cache = cache
+        self.workers = max(workers, 1)
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.urgent = collections.deque()
+        self.prefetching = collections.deque()
+        # name -> Future of the names that are queued or being resolved
+        self.futures = {}
+        self.threads = []
+        self.stopping = False
+
+    def resolve(self, name, urgent=True) -> concurrent.futures.Future:
+        with self.lock:
+            future = self.futures.get(name)
+            if future is not None:
+                if urgent and not future.running():
+                    # Queued by prefetch(), the worker that gets to it first resolves it
+                    self.urgent.append(name)
+                    self.ready.notify()
+                return future
+            future = concurrent.futures.Future()
+            if is_address(name):
+                future.set_result([name])
+                return future
+            entry = self.cache.get(name)
+            if entry is not None:
+                future.set_result(entry.addresses)
+                return future
+            self.futures[name] = future
+            (self.urgent if urgent else self.prefetching).append(name)
+            if len(self.threads) < self.workers:
+                thread = threading.Thread(target=self._work, daemon=True)
+                self.threads.append(thread)
+                thread.start()
+            self.ready.notify()
+            return future
+
+    def prefetch(self, names) -> int:
+        # Queues the names that aren't cached, returns how many were queued
+        return sum(1 for name in names if not self.resolve(name, urgent=False).done())
+
+    def _work(self):
+        while True:
+            with self.lock:
+                while not self.urgent and not self.prefetching and not self.stopping:
+                    self.ready.wait()
+                if self.stopping:
+                    return
+                name = (self.urgent or self.prefetching).popleft()
+                future = self.futures.get(name)
+                # Names queued twice are only resolved by the first worker to get to them
+                if future is None or future.running():
+                    continue
+                future.set_running_or_notify_cancel()
+            addresses = get_addresses(name)
+            # A failure that may be temporary is asked about again by the next probe
+            if addresses is not None:
+                self.cache.update(name, addresses)
+            with self.lock:
+                del self.futures[name]
+            future.set_result(addresses)
+
+    def stop(self):
+        # Drops the queued names, names being resolved finish on their daemon threads
+        with self.lock:
+            self.stopping = True
+            self.urgent.clear()
+            self.prefetching.clear()
+            self.ready.notify_all()
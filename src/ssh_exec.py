@@ -0,0 +1,162 @@
+import asyncio
+import re
+import threading
+import time
+from ssh_probe import WakeupQueue
+
+# Nobody is there to answer prompts, so hosts that would ask for a password fail instead
+EXEC_SSH_OPTIONS = ['-o', 'BatchMode=yes', '-o', 'ConnectTimeout=5']
+
+class ExecResult:
+    __slots__ = ('hostname', 'returncode', 'output', 'duration')
+
+    def __init__(self, hostname, returncode, output, duration):
+        # returncode is None if the command timed out, ssh itself exits with 255 on connection errors
+        self.hostname = hostname
+        self.returncode = returncode
+        self.output = output
+        self.duration = duration
+
+def get_exec_command(hostname, command, pool=None) -> list:
+    options = pool.ssh_options(hostname) if pool is not None else []
+    return ['ssh', *EXEC_SSH_OPTIONS, *options, hostname, command]
+
+async def run_on_host(hostname, command, timeout, pool=None) -> ExecResult:
+    started = time.monotonic()
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *get_exec_command(hostname, command, pool),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT)
+    except OSError as e:
+        return ExecResult(hostname, 255, str(e), time.monotonic() - started)
+
+    output = b''
+    try:
+        output, _ = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+            returncode = None
+        else:
+            returncode = process.returncode
+    return ExecResult(hostname, returncode, output.decode(errors='replace'), time.monotonic() - started)
+
+async def run_all(hostnames, command, on_result, concurrency=32, timeout=60, pool=None):
+    """
+    Runs `command` on every host with at most `concurrency` ssh processes at a time,
+    calling on_result with each ExecResult as soon as its host is done.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(hostname):
+        async with semaphore:
+            result = await run_on_host(hostname, command, timeout, pool)
+        on_result(result)
+
+    await asyncio.gather(*(run_one(hostname) for hostname in hostnames))
+
+def compress_hostnames(hostnames) -> str:
+    """
+    Joins host names, folding names that only differ in a trailing number into a range,
+    e.g. web1, web2, web3, db1 becomes web[1-3],db1.
+    """
+    numbered = {}
+    names = []
+    for hostname in hostnames:
+        match = re.fullmatch(r'(.*?)(\d+)', hostname)
+        if match is None:
+            names.append(hostname)
+            continue
+        prefix, number = match.groups()
+        if prefix not in numbered:
+            numbered[prefix] = []
+            names.append(prefix)
+        numbered[prefix].append(number)
+
+    parts = []
+    for name in names:
+        if name not in numbered:
+            parts.append(name)
+            continue
+        numbers = numbered[name]
+        if len(numbers) == 1:
+            parts.append(name + numbers[0])
+            continue
+        # Leading zeros are kept by only joining numbers of the same width
+        numbers = sorted(set(numbers), key=lambda n: (len(n), int(n)))
+        ranges = []
+        start = previous = numbers[0]
+        for number in numbers[1:] + [None]:
+            if number is not None and len(number) == len(previous) and int(number) == int(previous) + 1:
+                previous = number
+                continue
+            ranges.append(start if start == previous else f'{start}-{previous}')
+            start = previous = number
+        parts.append(f'{name}[{",".join(ranges)}]')
+    return ','.join(parts)
+
+def group_results(results) -> list:
+    # Returns (output, results) for each distinct output, most common output first (like dshbak -c)
+    groups = {}
+    for result in results:
+        groups.setdefault(result.output, []).append(result)
+    return sorted(groups.items(), key=lambda group: -len(group[1]))
+
+def format_status(result) -> str:
+    status = 'timeout' if result.returncode is None else f'exit {result.returncode}'
+    return f'{result.hostname}: {status} ({result.duration:.2f}s)'
+
+def format_results(results) -> list:
+    # Output lines grouped by identical output, followed by the exit code and duration of every host
+    lines = []
+    for output, group in group_results(results):
+        title = f'{compress_hostnames([result.hostname for result in group])} ({len(group)})'
+        lines += ['-' * len(title), title, '-' * len(title)]
+        lines += output.rstrip('\n').split('\n') if output else ['(no output)']
+        lines.append('')
+    if results:
+        lines += [format_status(result) for result in sorted(results, key=lambda result: result.hostname)]
+    return lines
+
+class ExecJob:
+    """
+    Runs a command on hosts in a background thread (see run_all).
+    Each ExecResult is put on `results`, a WakeupQueue, as soon as its host is done.
+    """
+    def __init__(self, hostnames, command, concurrency=32, timeout=60, pool=None):
+        self.hostnames = list(hostnames)
+        self.command = command
+        self.results = WakeupQueue()
+        self.loop = asyncio.new_event_loop()
+        self.task = None
+        self.done = False
+        self.thread = threading.Thread(target=self._run, args=(concurrency, timeout, pool), daemon=True)
+        self.thread.start()
+
+    def _run(self, concurrency, timeout, pool):
+        asyncio.set_event_loop(self.loop)
+        self.task = self.loop.create_task(run_all(self.hostnames, self.command, self.results.put, concurrency, timeout, pool))
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.loop.close()
+            self.done = True
+            # Wakes the reader, so it notices the job is done
+            self.results.put(None)
+
+    def cancel(self):
+        # Kills the running ssh processes, results of hosts that were done are kept
+        try:
+            self.loop.call_soon_threadsafe(lambda: self.task.cancel())
+        except RuntimeError:
+            # The loop is already closed, so the job was done anyway
+            pass
+        self.thread.join()
+        self.results.close()
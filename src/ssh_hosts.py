@@ -1,10 +1,17 @@
 #!/usr/bin/python3
 import os
-import subprocess
-import threading
+import sys
 import argparse
 import pwd
 import json
+import glob
+import pickle
+import re
+import shlex
+import ssh_cache
+from ssh_model import Host
+# ssh_probe, ssh_exec and asyncio are imported by the functions that probe or run commands,
+# so reading the config (all ssh-browse needs for its first frame) doesn't pay for them
 #import logging
 
 # Configure logging
@@ -16,59 +23,562 @@ def uniqify(seq):
     seen_add = seen.add
     return [x for x in seq if not (x in seen or seen_add(x))]
 
-def import_json_config(filename):
+# Read size of the streaming JSON reader, only this much of an export is held as text at a time
+JSON_CHUNK_SIZE = 1 << 16
+JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+class JSONStream:
+    """
+    Reads the values of a JSON document one at a time from `file`, keeping only a chunk of
+    the text in memory. Containers are walked with expect(), their members read with value().
+    """
+    def __init__(self, file):
+        self.file = file
+        self.buffer = ''
+        self.position = 0
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        # Appends the next chunk to what is left of the buffer, returns False at the end of the file
+        chunk = self.file.read(JSON_CHUNK_SIZE)
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return bool(chunk)
+
+    def peek(self) -> str:
+        # The next character that isn't whitespace, or '' at the end of the file
+        while True:
+            self.position = JSON_WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._fill():
+                return ''
+
+    def expect(self, characters) -> str:
+        character = self.peek()
+        if not character or character not in characters:
+            raise ValueError(f'Expected one of {characters!r} in JSON, found {character or "the end of the file"!r}')
+        self.position += 1
+        return character
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                # The value continues in the next chunk
+                if not self._fill():
+                    raise
+                continue
+            # So does a number that ends with the buffer
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.position = end
+            return value
+
+def iter_json_object(stream):
+    # (name, hostconfig) of {"name": {...}, ...}, hosts that aren't an object are skipped
+    stream.expect('{')
+    if stream.peek() == '}':
+        stream.expect('}')
+        return
+    while True:
+        name = stream.value()
+        stream.expect(':')
+        hostconfig = stream.value()
+        if isinstance(hostconfig, dict):
+            yield name, hostconfig
+        if stream.expect(',}') == '}':
+            return
+
+def split_record(record):
+    # (name, hostconfig) of {"Host": "name", ...}, or None for a record that doesn't name its host
+    if not isinstance(record, dict) or not isinstance(record.get('Host'), str):
+        return None
+    return record.pop('Host'), record
+
+def iter_json_array(stream):
+    # (name, hostconfig) of [{"Host": "name", ...}, ...], records without a Host are skipped
+    stream.expect('[')
+    if stream.peek() == ']':
+        stream.expect(']')
+        return
+    while True:
+        host = split_record(stream.value())
+        if host is not None:
+            yield host
+        if stream.expect(',]') == ']':
+            return
+
+def iter_ndjson(file):
+    # (name, hostconfig) of one {"Host": "name", ...} object per line, records without a Host are skipped
+    for line in file:
+        if line.strip():
+            host = split_record(json.loads(line))
+            if host is not None:
+                yield host
+
+def is_ndjson(filename, first_line) -> bool:
+    """
+    A first line that is a whole JSON object naming its host with a string "Host" is a line of NDJSON.
+    An object export maps each host name to an object, so it never has a string "Host",
+    even when it is written on a single line or has a host called Host.
+    """
+    if filename.endswith(('.ndjson', '.jsonl')):
+        return True
+    try:
+        record = json.loads(first_line)
+    except ValueError:
+        return False
+    return isinstance(record, dict) and isinstance(record.get('Host'), str)
+
+def normalize_json_value(value):
+    # Values are strings like in an ssh config, lists become space separated like Aliases
+    if isinstance(value, bool):
+        return 'yes' if value else 'no'
+    if isinstance(value, list):
+        return ' '.join(str(item) for item in value)
+    if isinstance(value, (dict, type(None))):
+        return None
+    return str(value)
+
+def normalize_json_host(name, hostconfig, fields=None) -> Host:
+    """
+    Builds the Host of one exported host, with keywords spelled like read_ssh_config spells them.
+    If `fields` is given only those keys are kept, and HostName and Category. Reachable starts as 'unknown'.
+    """
+    hostname, category = None, 'Default'
+    options = []
+    for key, value in hostconfig.items():
+        key = CANONICAL_KEYWORDS.get(key.lower(), key)
+        if type(value) is not str:
+            value = normalize_json_value(value)
+            if value is None:
+                continue
+        if key == 'Category':
+            category = value
+        elif key == 'Reachable':
+            # The export's state is stale, hosts are probed again like those of an ssh config
+            continue
+        elif key == 'HostName':
+            # Without it hosts would be probed and connected to by their name
+            hostname = value
+        elif fields is not None and key not in fields:
+            continue
+        else:
+            # User, Port and the like repeat for every host of an export, interning keeps one copy of each
+            options += (sys.intern(key), sys.intern(value))
+    return Host(str(name), hostname, category, options, 'unknown')
+
+def iter_json_config(filename, fields=None):
+    """
+    Yields the (name, Host) of each host in a JSON export, reading the file as it goes.
+    The export is either an object of hosts ({"name": {"HostName": ...}, ...}), an array
+    of hosts or NDJSON with one host per line, where each host is named by its "Host" key.
+    Raises ValueError if anything but whitespace follows the object or array of an export.
+    """
+    fields = set(fields) if fields else None
     with open(filename, 'r') as file:
-        ssh_config = json.load(file)
-    return ssh_config
+        # Limited, since an export on a single line would otherwise be read whole
+        first_line = file.readline(JSON_CHUNK_SIZE)
+        file.seek(0)
+        stream = None
+        if is_ndjson(filename, first_line):
+            hosts = iter_ndjson(file)
+        else:
+            stream = JSONStream(file)
+            hosts = iter_json_array(stream) if stream.peek() == '[' else iter_json_object(stream)
+        for name, hostconfig in hosts:
+            yield name, normalize_json_host(name, hostconfig, fields)
+        # Likely NDJSON that wasn't recognized, or two exports written into one file
+        if stream is not None and stream.peek():
+            raise ValueError(f'Unexpected {stream.peek()!r} after the hosts of {filename}')
 
-def read_ssh_config(filename):
+def import_json_config(filename, fields=None, progress=None) -> dict:
+    # Reads a JSON export (see iter_json_config), calling progress with the number of hosts read so far
     ssh_config = {}
-    #ssh_config_list = []
+    for name, host in iter_json_config(filename, fields):
+        ssh_config[name] = host
+        if progress is not None and len(ssh_config) % 10000 == 0:
+            progress(len(ssh_config))
+    return ssh_config
+
+# Keywords are case insensitive in ssh_config, these are stored with their usual spelling
+CANONICAL_KEYWORDS = {k.lower(): k for k in [
+    'HostName', 'User', 'Port', 'IdentityFile', 'ProxyJump', 'ProxyCommand', 'ForwardAgent',
+    'LocalForward', 'RemoteForward', 'DynamicForward', 'ControlMaster', 'ControlPath', 'ControlPersist',
+]}
+
+# ssh stops following Includes at this depth
+MAX_INCLUDE_DEPTH = 16
+
+CONFIG_CACHE_VERSION = 2
 
+def split_config_line(line):
+    # "Key value", "Key=value" and "Key = value" are all valid
+    parts = line.split(None, 1)
+    key = parts[0]
+    value = parts[1].strip() if len(parts) > 1 else ''
+    if '=' in key:
+        key, rest = key.split('=', 1)
+        value = f'{rest} {value}'.strip()
+    elif value.startswith('='):
+        value = value[1:].strip()
+    return key, value
+
+def parse_config_file(filename) -> list:
+    """
+    Parses a single config file into a list of events, without following Includes:
+    ('category', name), ('host', patterns), ('match', value), ('include', patterns) and ('option', key, value).
+    The events don't depend on any other file, so they can be cached per file.
+    """
+    events = []
     with open(filename, 'r') as file:
-        current_host = None
-        current_config = {}
-        current_category = 'Default'
         for line in file:
             # Remove leading and trailing whitespaces
             line = line.strip()
             # Skip empty lines
             if not line:
                 continue
+            # Comments name the category of the hosts below them
             if line.startswith('#'):
-                current_category = line[2:]
+                events.append(('category', line[2:]))
+                continue
+            key, value = split_config_line(line)
+            if not key or not value:
+                continue
+            keyword = key.lower()
+            if keyword == 'host':
+                events.append(('host', value.split()))
+            elif keyword == 'match':
+                events.append(('match', value))
+            elif keyword == 'include':
+                events.append(('include', value.split()))
+            else:
+                events.append(('option', CANONICAL_KEYWORDS.get(keyword, key), value))
+    return events
+
+def compile_patterns(patterns):
+    # ssh patterns only know * and ?, and a leading ! negates the pattern
+    positive, negative = [], []
+    for pattern in patterns:
+        target = negative if pattern.startswith('!') else positive
+        regex = re.escape(pattern.lstrip('!').lower()).replace(r'\*', '.*').replace(r'\?', '.')
+        target.append(f'(?:{regex})')
+    return (re.compile('|'.join(positive)) if positive else None,
+            re.compile('|'.join(negative)) if negative else None)
+
+def match_patterns(compiled, name) -> bool:
+    positive, negative = compiled
+    name = name.lower()
+    if negative is not None and negative.fullmatch(name):
+        return False
+    return positive is not None and positive.fullmatch(name) is not None
+
+def is_pattern(name) -> bool:
+    return '*' in name or '?' in name or name.startswith('!')
+
+class ConfigBlock:
+    __slots__ = ('kind', 'names', 'compiled', 'criteria', 'category', 'options')
+
+    def __init__(self, kind, category, names=None, compiled=None, criteria=None):
+        # kind is 'global' (options before the first Host), 'host', 'pattern' or 'match'
+        self.kind = kind
+        self.category = category
+        self.names = names or []
+        self.compiled = compiled
+        self.criteria = criteria
+        self.options = []
+
+def parse_match_criteria(value) -> list:
+    # Returns (negated, keyword, argument) tuples
+    try:
+        tokens = shlex.split(value)
+    except ValueError:
+        tokens = value.split()
+    criteria = []
+    i = 0
+    while i < len(tokens):
+        keyword = tokens[i].lower()
+        negated = keyword.startswith('!')
+        keyword = keyword.lstrip('!')
+        argument = None
+        if keyword not in ('all', 'canonical', 'final') and i + 1 < len(tokens):
+            i += 1
+            argument = tokens[i]
+        criteria.append((negated, keyword, argument))
+        i += 1
+    return criteria
+
+def evaluate_match(criteria, hostname, options) -> bool:
+    """
+    Evaluates Match criteria for a host, given the options collected so far.
+    Criteria that can't be decided without connecting (exec, localnetwork, tagged, canonical)
+    never match, so those blocks are skipped instead of running commands while parsing.
+    """
+    for negated, keyword, argument in criteria:
+        if keyword in ('all', 'final'):
+            result = True
+        elif keyword == 'host':
+            result = match_patterns(compile_patterns(argument.split(',')), options.get('HostName', hostname))
+        elif keyword == 'originalhost':
+            result = match_patterns(compile_patterns(argument.split(',')), hostname)
+        elif keyword == 'user':
+            result = match_patterns(compile_patterns(argument.split(',')), options.get('User', get_local_user()))
+        elif keyword == 'localuser':
+            result = match_patterns(compile_patterns(argument.split(',')), get_local_user())
+        else:
+            return False
+        if result == negated:
+            return False
+    return True
+
+def get_local_user():
+    return pwd.getpwuid(os.getuid()).pw_name
+
+class ConfigSources:
+    """
+    Every file read while parsing a config, with the mtime and size it had,
+    and the directories searched by Include globs, so new files there are noticed too.
+    """
+    def __init__(self, files=None, dirs=None, events=None):
+        self.files = files or {}
+        self.dirs = dirs or {}
+        self.events = events or {}
+
+    def add_file(self, filename):
+        # Records the mtime and size `filename` has now
+        stat = os.stat(filename)
+        self.files[filename] = (stat.st_mtime_ns, stat.st_size)
+        return self.files[filename]
+
+    def is_current(self) -> bool:
+        try:
+            for filename, (mtime, size) in self.files.items():
+                stat = os.stat(filename)
+                if stat.st_mtime_ns != mtime or stat.st_size != size:
+                    return False
+            for dirname, mtime in self.dirs.items():
+                if os.stat(dirname).st_mtime_ns != mtime:
+                    return False
+        except OSError:
+            return False
+        return True
+
+def read_config_events(filename, sources, parsed_events=None) -> list:
+    # Reuses the events of a file that hasn't changed since it was last parsed
+    signature = sources.add_file(filename)
+    cached = (parsed_events or {}).get(filename)
+    if cached is not None and cached[0] == signature:
+        events = cached[1]
+    else:
+        events = parse_config_file(filename)
+    sources.events[filename] = (signature, events)
+    return events
+
+def expand_include(pattern, base_dir, sources) -> list:
+    pattern = os.path.expanduser(pattern)
+    if not os.path.isabs(pattern):
+        pattern = os.path.join(base_dir, pattern)
+    dirname = os.path.dirname(pattern)
+    if glob.has_magic(pattern) and os.path.isdir(dirname):
+        sources.dirs[dirname] = os.stat(dirname).st_mtime_ns
+    return sorted(glob.glob(pattern))
+
+def collect_config_blocks(filename, base_dir, sources, parsed_events, blocks, category, current, depth):
+    for event in read_config_events(filename, sources, parsed_events):
+        kind = event[0]
+        if kind == 'category':
+            category = event[1]
+        elif kind == 'host':
+            patterns = event[1]
+            names = [name for name in patterns if not is_pattern(name)]
+            if len(names) == len(patterns):
+                current = ConfigBlock('host', category, names)
+            else:
+                current = ConfigBlock('pattern', category, names, compile_patterns(patterns))
+            blocks.append(current)
+        elif kind == 'match':
+            current = ConfigBlock('match', category, criteria=parse_match_criteria(event[1]))
+            blocks.append(current)
+        elif kind == 'include':
+            if depth >= MAX_INCLUDE_DEPTH:
                 continue
-            # Check if the line starts with "Host" to identify the start of a new section
-            if line.startswith('Host '):
-                # If a host is already being processed, save its config
-                if current_host is not None:
-                    ssh_config[current_host] = current_config
-                    #ssh_config_list.append(current_config)
-                # Extract aliases
-                aliases = []
-                s = line.split(' ')
-                if len(s)>2:
-                    for j in range(2, len(s)):
-                        aliases.append(s[j])
-                # Extract the host name from the line
-                current_host = line.split()[1]
-                current_config = {}
-                current_config['Reachable'] = 'unknown'
-                current_config['Category'] = current_category  
-                if len(aliases) > 0: current_config['Aliases'] = ' '.join(aliases)
+            for pattern in event[1]:
+                for included in expand_include(pattern, base_dir, sources):
+                    if os.path.isfile(included):
+                        # The included file starts in the current block and category,
+                        # but doesn't change them for the rest of this file
+                        collect_config_blocks(included, base_dir, sources, parsed_events, blocks, category, current, depth + 1)
+        else:
+            if current is None:
+                current = ConfigBlock('global', category)
+                blocks.append(current)
+            current.options.append((event[1], event[2]))
+
+def get_named_hosts(events):
+    """
+    Names of the hosts a file's events define, or None if the file can affect hosts defined elsewhere:
+    it has Host patterns, Match blocks or Includes, or options before its first Host block,
+    which belong to the block it was included from.
+    """
+    names = set()
+    in_block = False
+    for event in events:
+        kind = event[0]
+        if kind == 'host':
+            if any(is_pattern(name) for name in event[1]):
+                return None
+            names.update(event[1])
+            in_block = True
+        elif kind in ('match', 'include'):
+            return None
+        elif kind == 'option' and not in_block:
+            return None
+    return names
+
+def get_changed_hosts(previous_events, events):
+    """
+    Names of the hosts whose options may differ between two reads of a config, given the events
+    of each file in both. Returns None if any host may differ.
+    """
+    changed = set()
+    for filename in previous_events.keys() | events.keys():
+        previous = previous_events.get(filename)
+        current = events.get(filename)
+        if previous is not None and current is not None and previous[0] == current[0]:
+            continue
+        for file_events in (previous, current):
+            if file_events is not None:
+                names = get_named_hosts(file_events[1])
+                if names is None:
+                    return None
+                changed |= names
+    return changed
+
+def resolve_host(current_host, first_block, blocks, named_blocks, dynamic_blocks) -> Host:
+    # The effective options of one host, from its own blocks and the pattern and Match blocks that apply to it
+    current_config = {}
+    if len(first_block.names) > 1: current_config['Aliases'] = ' '.join(first_block.names[1:])
+
+    options = {}
+    seen = set()
+    for index in sorted(named_blocks.get(current_host, []) + dynamic_blocks):
+        block = blocks[index]
+        if block.kind == 'pattern' and not match_patterns(block.compiled, current_host):
+            continue
+        if block.kind == 'match' and not evaluate_match(block.criteria, current_host, options):
+            continue
+        for key, value in block.options:
+            if key.lower() not in seen:
+                seen.add(key.lower())
+                options[key] = value
+    # The host's own options are listed before inherited ones
+    own_keys = [key for index in named_blocks.get(current_host, []) for key, _ in blocks[index].options if key in options]
+    for key in own_keys:
+        current_config[key] = options[key]
+    for key, value in options.items():
+        current_config.setdefault(key, value)
+    hostname = current_config.pop('HostName', None)
+    # Keys repeat for every host, interning them keeps one copy of each
+    flat_options = [item for key, value in current_config.items() for item in (sys.intern(key), value)]
+    return Host(current_host, hostname, first_block.category, flat_options)
+
+def read_ssh_config(filename, sources=None, parsed_events=None, previous=None):
+    """
+    Reads an ssh config, following Includes, and returns a dict with a ssh_model.Host holding the effective options of each host.
+    Options from Host patterns and Match blocks are applied like ssh does: the first value found wins.
+    If `sources` is given it is filled with the files that were read.
+    `parsed_events` are the events of each file from an earlier read, only files that changed since are parsed again.
+    If `previous` holds the hosts of that read, only the hosts named in changed files are resolved again,
+    as long as those files only hold plain Host blocks, the others are taken from `previous`.
+    """
+    if sources is None:
+        sources = ConfigSources()
+    blocks = []
+    base_dir = os.path.dirname(os.path.abspath(os.path.expanduser(filename)))
+    collect_config_blocks(filename, base_dir, sources, parsed_events, blocks, 'Default', None, 0)
+
+    # Concrete host names are looked up directly, only pattern and Match blocks are tested against every host
+    named_blocks = {}
+    dynamic_blocks = []
+    hosts = {}
+    for index, block in enumerate(blocks):
+        if block.kind in ('global', 'pattern', 'match'):
+            dynamic_blocks.append(index)
+        if block.kind == 'host':
+            for name in block.names:
+                named_blocks.setdefault(name, []).append(index)
+        if block.names and block.names[0] not in hosts:
+            hosts[block.names[0]] = block
+
+    changed = get_changed_hosts(parsed_events, sources.events) if previous is not None and parsed_events is not None else None
+    ssh_config = {}
+    for current_host, first_block in hosts.items():
+        if changed is not None and current_host not in changed and current_host in previous:
+            ssh_config[current_host] = previous[current_host]
+        else:
+            ssh_config[current_host] = resolve_host(current_host, first_block, blocks, named_blocks, dynamic_blocks)
+
+    return ssh_config
+
+def load_ssh_config(filename, cache_filename, sources=None):
+    """
+    Same as read_ssh_config, but keeps a pickled copy of the result in `cache_filename`.
+    The copy is used as long as none of the files it was read from have changed,
+    otherwise only the changed files are parsed again, and only the hosts they name resolved again.
+    If `sources` is given it is filled with the files and directories the hosts were read from.
+    """
+    # The cache holds two pickles: the result with its sources, then the parsed events of each file,
+    # which are only needed when something changed
+    cache = None
+    parsed_events = None
+    previous = None
+    if sources is None:
+        sources = ConfigSources()
+    try:
+        with open(cache_filename, 'rb') as file:
+            cache = pickle.load(file)
+            if cache.get('version') != CONFIG_CACHE_VERSION or cache.get('filename') != filename:
+                cache = None
+            elif ConfigSources(cache['files'], cache['dirs']).is_current():
+                sources.files.update(cache['files'])
+                sources.dirs.update(cache['dirs'])
+                return {name: Host(name, hostname, category, options) for name, hostname, category, options in cache['data']}
             else:
-                # Split the line into key-value pairs
-                key, value = map(str.strip, line.split(None, 1))
-                # Store key-value pairs in the current host's config
-                current_config[key] = value
-        # Save the last host's config
-        if current_host is not None:
-            ssh_config[current_host] = current_config
-            #ssh_config_list.append(current_config)
-
-    #for c in ssh_config_list: print(c)
+                parsed_events = pickle.load(file)
+                previous = {name: Host(name, hostname, category, options) for name, hostname, category, options in cache['data']}
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError, KeyError, TypeError, IndexError):
+        # Rebuilt from the config files
+        cache = parsed_events = previous = None
+
+    ssh_config = read_ssh_config(filename, sources, parsed_events, previous)
+
+    def write_cache(file):
+        # Only builtin types are pickled, so the cache can be read no matter which script wrote it
+        data = [(name, host.hostname, host.category, host.options) for name, host in ssh_config.items()]
+        cache = {'version': CONFIG_CACHE_VERSION, 'filename': filename, 'files': sources.files,
+                 'dirs': sources.dirs, 'data': data}
+        pickle.dump(cache, file, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(sources.events, file, pickle.HIGHEST_PROTOCOL)
+
+    try:
+        ssh_cache.write_atomic(cache_filename, write_cache, binary=True)
+    except OSError:
+        pass
     return ssh_config
 
+def diff_hosts(old, new) -> tuple:
+    # (added, removed, changed) host names between two reads, changed hosts have another HostName, Category or options
+    added = [name for name in new if name not in old]
+    removed = [name for name in old if name not in new]
+    changed = []
+    for name, host in new.items():
+        previous = old.get(name)
+        if previous is not None and previous is not host and (previous.hostname, previous.category_id, previous.options) != (host.hostname, host.category_id, host.options):
+            changed.append(name)
+    return added, removed, changed
 
 def get_values(key, ssh_config_data) -> list:
     values = []
@@ -84,40 +594,24 @@ def get_values(key, ssh_config_data) -> list:
 def get_categories(ssh_config_data) -> list:
     categories = []
 
-    for k in ssh_config_data.keys():
-        category = ssh_config_data[k]['Category']
-        categories.append(category)
+    for host in ssh_config_data.values():
+        categories.append(host.category)
     
     #categories = list(set(categories))
     categories = uniqify(categories)
     return categories
 
-def check_reachable(hostconfig) -> bool:
-    host = hostconfig.get('HostName', "")  
-
-    command = f'ssh -o BatchMode=yes -o ConnectTimeout=3 -o PubkeyAuthentication=no -o PasswordAuthentication=no -o KbdInteractiveAuthentication=no -o ChallengeResponseAuthentication=no -o StrictHostKeyChecking=no'
-    command += f' {host} 2>&1 | grep -F -q "Permission denied"; echo $?'
-    
-    #logging.debug(f"Command: {command}")
-    reachable = int(subprocess.check_output(command, shell=True))
-    if reachable == 0:
-        hostconfig['Reachable'] = 'yes'
-        return True
-    
-    hostconfig['Reachable'] = 'no'
-    return False
-
-def check_reachable_all(ssh_config_data, wait):
-    # Check reachable
-    threads = []
-    for k in ssh_config_data.keys():
-        thread = threading.Thread(target=check_reachable, args=(ssh_config_data.get(k),))
-        threads.append(thread)
-        thread.start()
-
+def check_reachable_all(ssh_config_data, wait, concurrency=64, timeout=5, mode='ssh', category_modes=None):
+    # Probes run on one asyncio loop with a bounded number of ssh processes and sockets.
+    # When waiting, returns the ssh_probe.ProbeResult of each host
+    import asyncio
+    import threading
+    import ssh_probe
+    coroutine = ssh_probe.probe_all(ssh_config_data, concurrency, timeout, mode, category_modes)
     if wait:
-        for thread in threads:
-            thread.join()
+        return asyncio.run(coroutine)
+    else:
+        threading.Thread(target=asyncio.run, args=(coroutine,), daemon=True).start()
 
 
 def test1():
@@ -135,6 +629,23 @@ def test1():
     for k in ssh_config_data.keys():
         print(ssh_config_data[k])
 
+def exec_hosts(hostnames, command, concurrency=32, timeout=60) -> int:
+    """
+    Runs `command` on the hosts in parallel. Each host is reported on stderr as soon as it is done,
+    then the output is printed grouped by identical output. Returns the number of failed hosts.
+    """
+    import asyncio
+    import ssh_exec
+    results = []
+
+    def on_result(result):
+        results.append(result)
+        print(ssh_exec.format_status(result), file=sys.stderr, flush=True)
+
+    asyncio.run(ssh_exec.run_all(hostnames, command, on_result, concurrency, timeout))
+    print('\n'.join(ssh_exec.format_results(results)))
+    return sum(1 for result in results if result.returncode != 0)
+
 def test2(args):
     # Locate config file
     config_location = '/home/' + os.getlogin() + '/.ssh/config'
@@ -144,7 +655,18 @@ def test2(args):
     output = []
 
     if (args.ssh_ping):
-        check_reachable_all(ssh_config_data, True)
+        results = check_reachable_all(ssh_config_data, True)
+        if args.json:
+            # One JSON object per line, for feeding into other tools
+            for k, result in results.items():
+                print(json.dumps({
+                    'host': k,
+                    'category': ssh_config_data[k]['Category'],
+                    'reachable': result.reachable,
+                    'failure': result.failure,
+                    'latency_ms': round(result.latency * 1000, 1),
+                    'timestamp': round(result.timestamp, 3)}))
+            return
     
     #hostnames = get_values('HostName', ssh_config_data)
     #print(hostnames)
@@ -155,7 +677,7 @@ def test2(args):
             s += f' ({ssh_config_data[k]["HostName"]})'
         if args.ssh_ping:
             reachable = ssh_config_data[k]["Reachable"]
-            if reachable == 'true':
+            if reachable == 'yes':
                 s = 'o ' + s
             else:
                 s = 'x ' + s
@@ -170,8 +692,27 @@ if __name__ == '__main__':
     parser.add_argument("-c", "--categories", help = "show categories", action="store_true")
     parser.add_argument("-p", "--ssh-ping", help = "test connection to hosts", action="store_true")
     parser.add_argument("-n", "--hostnames", help = "shows the HostName value for each host", action="store_true")
+    parser.add_argument("-j", "--json", help = "with --ssh-ping, prints each probe result as a line of JSON", action="store_true")
+    parser.add_argument("-e", "--exec", metavar="COMMAND", help = "run COMMAND on the given hosts in parallel")
+    parser.add_argument("--concurrency", type=int, default=32, help = "maximum number of hosts --exec runs on at the same time")
+    parser.add_argument("--timeout", type=float, default=60, help = "seconds before --exec gives up on a host")
+    parser.add_argument("hosts", nargs='*', help = "hosts to run --exec on")
+    parser.add_argument("--daemon", help = "probe hosts for all running ssh-browse instances, until interrupted", action="store_true")
+    parser.add_argument("--socket", help = "Unix socket of --daemon (default: daemon_socket of config.json, or ~/.ssh-browse/daemon.sock)")
 
     args = parser.parse_args()    
     #print(args)
+    if args.daemon:
+        import ssh_daemon
+        try:
+            if not ssh_daemon.run_daemon(args.socket):
+                sys.exit("A daemon is already running")
+        except ValueError as e:
+            sys.exit(str(e))
+        sys.exit(0)
+    if args.exec:
+        if not args.hosts:
+            parser.error("--exec needs at least one host")
+        sys.exit(1 if exec_hosts(args.hosts, args.exec, args.concurrency, args.timeout) else 0)
     test2(args)
     #test1()
\ No newline at end of file
@@ -0,0 +1,110 @@
+import sys
+
+# Reachability states, a Host stores the index of its state. 'dns' is a host whose HostName didn't resolve
+REACHABILITY_STATES = ('unknown', 'pinging', 'yes', 'no', 'dns')
+UNKNOWN, PINGING, REACHABLE, UNREACHABLE, UNRESOLVED = range(len(REACHABILITY_STATES))
+REACHABILITY_IDS = {state: i for i, state in enumerate(REACHABILITY_STATES)}
+
+_MISSING = object()
+
+class CategoryTable:
+    """
+    Interns category names as small ints, so each host stores an int instead of a string.
+    """
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+
+    def intern(self, name) -> int:
+        category_id = self.ids.get(name)
+        if category_id is None:
+            category_id = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return category_id
+
+# Shared by all hosts, ids are never persisted so they only have to agree within one process
+CATEGORIES = CategoryTable()
+
+class Host:
+    """
+    One host of the ssh config. What is used on every frame or probe is kept in slots:
+    the name, HostName, category id, reachability state and latency of the last probe.
+    The other ssh options are kept in `options`, a flat (key, value, key, value, ...) tuple in config order.
+    A Host can also be used like the dict each host used to be: 'Reachable', 'Category' and 'HostName'
+    read and write the slots, other keys the options.
+    """
+    __slots__ = ('name', 'hostname', 'category_id', 'reachability', 'latency', 'options')
+
+    def __init__(self, name, hostname=None, category='Default', options=(), reachable='unknown', latency=None):
+        self.name = name
+        self.hostname = hostname
+        self.category_id = CATEGORIES.intern(category)
+        self.reachability = REACHABILITY_IDS.get(reachable, UNKNOWN)
+        self.latency = latency
+        self.options = tuple(options)
+
+    @property
+    def category(self) -> str:
+        return CATEGORIES.names[self.category_id]
+
+    @property
+    def reachable(self) -> str:
+        return REACHABILITY_STATES[self.reachability]
+
+    def option(self, key, default=None):
+        options = self.options
+        for i in range(0, len(options), 2):
+            if options[i] == key:
+                return options[i + 1]
+        return default
+
+    def properties(self) -> list:
+        # (key, value) of HostName and the options, which is what the properties column shows
+        options = self.options
+        properties = [('HostName', self.hostname)] if self.hostname is not None else []
+        properties += zip(options[::2], options[1::2])
+        return properties
+
+    def get(self, key, default=None):
+        if key == 'Reachable':
+            return REACHABILITY_STATES[self.reachability]
+        if key == 'Category':
+            return CATEGORIES.names[self.category_id]
+        if key == 'HostName':
+            return default if self.hostname is None else self.hostname
+        return self.option(key, default)
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key == 'Reachable':
+            self.reachability = REACHABILITY_IDS[value]
+        elif key == 'Category':
+            self.category_id = CATEGORIES.intern(value)
+        elif key == 'HostName':
+            self.hostname = value
+        else:
+            options = list(self.options)
+            for i in range(0, len(options), 2):
+                if options[i] == key:
+                    options[i + 1] = value
+                    break
+            else:
+                options += (sys.intern(key), value)
+            self.options = tuple(options)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def items(self) -> list:
+        return [('Reachable', self.reachable), ('Category', self.category)] + self.properties()
+
+    def keys(self) -> list:
+        return [key for key, _ in self.items()]
+
+    def values(self) -> list:
+        return [value for _, value in self.items()]
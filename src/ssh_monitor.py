@@ -0,0 +1,131 @@
+import math
+import heapq
+import random
+
+class HostSchedule:
+    __slots__ = ('due', 'delay', 'reachable', 'failures', 'flaps', 'probing')
+
+    def __init__(self, due):
+        self.due = due
+        # Seconds between scheduling the probe and `due`
+        self.delay = None
+        # Result of the last probe, 'yes', 'no', 'dns' or None before the first one
+        self.reachable = None
+        # Probes in a row that found the host down
+        self.failures = 0
+        # Changes of state, halved by every probe that found the host unchanged
+        self.flaps = 0.0
+        self.probing = False
+
+class MonitorScheduler:
+    """
+    Decides when each host is probed again while monitoring.
+    Hosts are kept in a heap of (due time, hostname) and probed every `interval` seconds.
+    Hosts that flap (changed state more than once recently) are probed four times as often,
+    hosts that are down back off exponentially, up to `max_interval` seconds.
+    Every delay is varied by up to `jitter` (a fraction of it), so hosts that were added
+    together drift apart instead of being probed in lockstep.
+    At most `rate` probes per second are started, with bursts of up to `rate` probes (at least one).
+    A `rate` of 0 starts every host as soon as it is due.
+    Times are time.monotonic() seconds.
+    """
+    FLAPPING = 2
+
+    def __init__(self, interval=60, max_interval=900, jitter=0.1, rate=10):
+        self.interval = interval
+        self.max_interval = max(max_interval, interval)
+        self.jitter = jitter
+        self.rate = rate
+        # Without a limit the budget never runs out
+        self.burst = max(rate, 1) if rate > 0 else math.inf
+        self.hosts = {}
+        self.heap = []
+        self.tokens = self.burst
+        self.refilled = None
+
+    def add(self, hostname, now):
+        # New hosts are spread over the first interval
+        if hostname not in self.hosts:
+            self._schedule(hostname, HostSchedule(None), now, random.uniform(0, self.interval))
+
+    def remove(self, hostname):
+        # Its heap entry is skipped when it comes up
+        self.hosts.pop(hostname, None)
+
+    def _schedule(self, hostname, schedule, now, delay):
+        due = now + delay
+        schedule.due = due
+        schedule.delay = delay
+        self.hosts[hostname] = schedule
+        heapq.heappush(self.heap, (due, hostname))
+
+    def get_delay(self, schedule) -> float:
+        if schedule.flaps >= self.FLAPPING:
+            delay = self.interval / 4
+        elif schedule.failures > 0:
+            delay = min(self.interval * 2 ** (schedule.failures - 1), self.max_interval)
+        else:
+            delay = self.interval
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def record(self, hostname, reachable, now):
+        """
+        Schedules the next probe of `hostname` after a probe found it `reachable` ('yes', 'no' or 'dns').
+        Results of probes the scheduler didn't start count too, they push the next probe back.
+        """
+        schedule = self.hosts.get(hostname)
+        if schedule is None:
+            return
+        if schedule.reachable is not None and schedule.reachable != reachable:
+            schedule.flaps += 1
+        else:
+            schedule.flaps /= 2
+        schedule.reachable = reachable
+        schedule.failures = schedule.failures + 1 if reachable != 'yes' else 0
+        schedule.probing = False
+        self._schedule(hostname, schedule, now, self.get_delay(schedule))
+
+    def _refill(self, now):
+        if self.rate > 0 and self.refilled is not None:
+            self.tokens = min(self.tokens + (now - self.refilled) * self.rate, self.burst)
+        self.refilled = now
+
+    def due(self, now) -> list:
+        # Returns the hosts to probe now, as many as the budget allows. Each is probed until record() is called for it
+        self._refill(now)
+        hosts = []
+        heap = self.heap
+        while heap and heap[0][0] <= now and self.tokens >= 1:
+            due, hostname = heapq.heappop(heap)
+            schedule = self.hosts.get(hostname)
+            # Entries of removed or rescheduled hosts are left in the heap until they come up
+            if schedule is None or schedule.due != due or schedule.probing:
+                continue
+            schedule.probing = True
+            self.tokens -= 1
+            hosts.append(hostname)
+        return hosts
+
+    def get_max_age(self, hostname):
+        """
+        Age up to which a result someone else got (the status daemon's) can stand in for probing
+        `hostname` now: the delay it was scheduled with, so flapping hosts are really checked
+        more often. None for hosts that aren't monitored.
+        """
+        schedule = self.hosts.get(hostname)
+        return schedule.delay if schedule is not None else None
+
+    def next_due(self, now):
+        # Seconds until due() has hosts to return, or None if nothing is scheduled
+        heap = self.heap
+        while heap:
+            due, hostname = heap[0]
+            schedule = self.hosts.get(hostname)
+            if schedule is not None and schedule.due == due and not schedule.probing:
+                break
+            heapq.heappop(heap)
+        if not heap:
+            return None
+        self._refill(now)
+        wait_for_budget = 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(heap[0][0] - now, wait_for_budget, 0)
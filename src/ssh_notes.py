@@ -0,0 +1,218 @@
+import os
+import re
+import json
+import mmap
+import bisect
+import itertools
+import ssh_cache
+
+# Words, including dots and dashes inside them so addresses and ticket numbers stay one token
+TOKEN_PATTERN = re.compile(r'\w(?:[\w.-]*\w)?')
+# Bumped when the tokens change, an index saved by another version is rebuilt
+NOTES_INDEX_VERSION = 1
+# Turns the digits of bin() into 0 and 1 bytes, for itertools.compress
+BINARY_DIGITS = bytes.maketrans(b'01', b'\x00\x01')
+
+class WrappedNotes:
+    """
+    The lines of a notes file cut to `width` characters.
+    The file is mapped with mmap and only wrapped as far as lines are asked for,
+    so showing the top of a large file doesn't read the rest of it.
+    """
+    def __init__(self, filename, width):
+        self.width = max(width, 1)
+        self.wrapped = []
+        self.offset = 0
+        self.map = None
+        with open(filename, 'rb') as file:
+            # An empty file can't be mapped
+            if os.fstat(file.fileno()).st_size > 0:
+                self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _wrap_next_line(self) -> bool:
+        # Wraps the next line of the file, returns False at the end of the file
+        if self.map is None:
+            return False
+        end = self.map.find(b'\n', self.offset)
+        if end == -1:
+            end = len(self.map)
+        line = self.map[self.offset:end].decode(errors='replace').rstrip('\r').expandtabs()
+        self.offset = end + 1
+        while len(line) > self.width:
+            self.wrapped.append(line[:self.width])
+            line = line[self.width:]
+        self.wrapped.append(line)
+        if self.offset >= len(self.map):
+            # Everything is wrapped, so the file is no longer needed
+            self.close()
+        return True
+
+    def lines(self, start, count) -> tuple:
+        """
+        Returns (start, lines) with up to `count` wrapped lines from `start`.
+        Past the end of the file, start is moved back so the last lines fill the window.
+        """
+        while len(self.wrapped) < start + count and self._wrap_next_line():
+            pass
+        start = max(min(start, len(self.wrapped) - count), 0)
+        return start, self.wrapped[start:start + count]
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+class NotesCache:
+    """
+    Least recently used WrappedNotes, keyed by (filename, mtime, width).
+    Every lookup stats the file, so a note that was edited is read again.
+    """
+    def __init__(self, size=32):
+        self.size = size
+        self.entries = {}
+
+    def get(self, filename, width):
+        # Returns the WrappedNotes of `filename`, or None if there are no notes for the host
+        try:
+            mtime = os.stat(filename).st_mtime_ns
+        except OSError:
+            return None
+        key = (filename, mtime, width)
+        notes = self.entries.pop(key, None)
+        if notes is None:
+            try:
+                notes = WrappedNotes(filename, width)
+            except OSError:
+                return None
+        self.entries[key] = notes
+        while len(self.entries) > self.size:
+            self.entries.pop(next(iter(self.entries))).close()
+        return notes
+
+def get_tokens(text) -> set:
+    """
+    Lowercase tokens of `text`. Tokens with dots or dashes are also split into their parts,
+    so INC-1234 is found by inc-1234 as well as by 1234.
+    """
+    tokens = set()
+    # Notes repeat words a lot, so only distinct words are matched
+    for word in set(text.lower().split()):
+        for token in TOKEN_PATTERN.findall(word):
+            tokens.add(token)
+            if '.' in token or '-' in token:
+                tokens.update(part for part in re.split(r'[.-]+', token) if part)
+    return tokens
+
+class NotesIndex:
+    """
+    Token index over the notes in `notes_dir`, saved as JSON in `filename`.
+    update() only reads notes whose mtime changed since the index was saved.
+    search() finds the hosts whose notes contain every word of a query, where the
+    last word may be incomplete (it matches as a prefix) since it is still being typed.
+    The index is replaced as a whole when it changes, so searches from another thread
+    never see it half updated.
+    """
+    def __init__(self, notes_dir, filename):
+        self.notes_dir = notes_dir
+        self.filename = filename
+        # host -> (mtime, tokens) of each notes file
+        self.files = {}
+        # (hosts, sorted tokens, {token: bitmask of hosts}, {query: hosts}), None until loaded
+        self.index = None
+        # Changes whenever the index does, so cached search results can be dropped
+        self.version = 0
+
+    def load(self):
+        try:
+            with open(self.filename, 'r') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return
+        if data.get('version') != NOTES_INDEX_VERSION:
+            return
+        self.files = {hostname: (mtime, tokens) for hostname, (mtime, tokens) in data['files'].items()}
+        self._build()
+
+    def save(self):
+        data = {'version': NOTES_INDEX_VERSION, 'files': {hostname: [mtime, sorted(tokens)] for hostname, (mtime, tokens) in self.files.items()}}
+        try:
+            ssh_cache.write_json_atomic(self.filename, data)
+        except OSError:
+            pass
+
+    def update(self, hostnames) -> bool:
+        """
+        Reads the notes of `hostnames` that are new or changed since the last update, and
+        forgets notes that were removed. Saves the index and returns True if anything changed.
+        """
+        try:
+            filenames = set(os.listdir(self.notes_dir))
+        except OSError:
+            filenames = set()
+        files = {}
+        changed = False
+        for hostname in hostnames:
+            if hostname not in filenames:
+                continue
+            filename = os.path.join(self.notes_dir, hostname)
+            try:
+                mtime = os.stat(filename).st_mtime_ns
+                known = self.files.get(hostname)
+                if known is not None and known[0] == mtime:
+                    files[hostname] = known
+                    continue
+                with open(filename, 'r', errors='replace') as file:
+                    files[hostname] = (mtime, get_tokens(file.read()))
+                changed = True
+            except OSError:
+                pass
+        changed = changed or len(files) != len(self.files)
+        self.files = files
+        if changed or self.index is None:
+            self._build()
+        if changed:
+            self.save()
+        return changed
+
+    def _build(self):
+        # Postings are bitmasks over the hosts with notes, so a query is a few ands and ors of ints
+        hostnames = list(self.files)
+        postings = {}
+        for bit, (_, tokens) in enumerate(self.files.values()):
+            for token in tokens:
+                postings.setdefault(token, []).append(bit)
+        for token, bits in postings.items():
+            mask = 0
+            for bit in bits:
+                mask |= 1 << bit
+            postings[token] = mask
+        self.index = (hostnames, sorted(postings), postings, {})
+        self.version += 1
+
+    def search(self, query) -> list:
+        # Returns the hosts whose notes contain every word of `query`, the list must not be modified
+        index = self.index
+        words = TOKEN_PATTERN.findall(query.lower())
+        if index is None or not words:
+            return []
+        hostnames, tokens, postings, cache = index
+        if query in cache:
+            return cache[query]
+
+        mask = -1
+        for word in words[:-1]:
+            mask &= postings.get(word, 0)
+        # The last word matches every token it is a prefix of
+        start = end = bisect.bisect_left(tokens, words[-1])
+        while end < len(tokens) and tokens[end].startswith(words[-1]):
+            end += 1
+        last = 0
+        for token in tokens[start:end]:
+            last |= postings[token]
+        mask &= last
+
+        # Bit i of the mask is the i-th host, so the reversed binary digits select the hosts
+        selected = bin(mask)[:1:-1].encode().translate(BINARY_DIGITS) if mask > 0 else b''
+        hosts = list(itertools.compress(hostnames, selected))
+        cache[query] = hosts
+        return hosts
@@ -0,0 +1,100 @@
+import os
+import hashlib
+import subprocess
+import threading
+import time
+
+class ControlPool:
+    """
+    Pool of ssh ControlMaster connections with their sockets in `directory`.
+    ssh commands started with ssh_options() share one master connection per host, so only
+    the first connection pays for the TCP, key exchange and authentication handshake.
+    A master exits `persist` seconds after its last session closed (ssh's ControlPersist).
+    At most `size` masters are kept, the least recently used one is stopped to make room.
+    """
+    def __init__(self, directory, persist=600, size=32):
+        self.directory = directory
+        self.persist = persist
+        self.size = size
+        self.lock = threading.Lock()
+        # Hosts with a master (or one being started), least recently used first
+        self.masters = {}
+        self.starting = set()
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def control_path(self, hostname) -> str:
+        # Hashed, since unix socket paths are limited to about 100 characters and ssh expands % in them
+        return os.path.join(self.directory, hashlib.sha1(hostname.encode()).hexdigest()[:16])
+
+    def ssh_options(self, hostname) -> list:
+        # Options for an ssh command to `hostname` that uses the master, or becomes it
+        with self.lock:
+            self.masters.pop(hostname, None)
+            self.masters[hostname] = time.time()
+            evicted = self._evict()
+        self._stop(evicted)
+        return ['-o', 'ControlMaster=auto',
+                '-o', f'ControlPath={self.control_path(hostname)}',
+                '-o', f'ControlPersist={self.persist}']
+
+    def is_alive(self, hostname) -> bool:
+        # A master removes its socket when it exits
+        return os.path.exists(self.control_path(hostname))
+
+    def check_command(self, hostname) -> list:
+        # Exits with status 0 if the master for `hostname` is running and accepts sessions
+        return ['ssh', '-O', 'check', '-o', f'ControlPath={self.control_path(hostname)}', hostname]
+
+    def warm_command(self, hostname):
+        """
+        Returns the command that starts a master for `hostname` in the background,
+        or None if it has one already or the pool is full. Warming never evicts a master,
+        so probing many hosts doesn't churn through the pool.
+        Call warmed() when the command has finished.
+        """
+        with self.lock:
+            if hostname in self.starting or (hostname in self.masters and self.is_alive(hostname)):
+                return None
+            self._evict()
+            if len(self.masters) >= self.size:
+                return None
+            self.starting.add(hostname)
+            self.masters[hostname] = time.time()
+        # BatchMode, since nobody is there to answer a password prompt
+        return ['ssh', '-f', '-N', '-o', 'BatchMode=yes', '-o', 'ConnectTimeout=5',
+                '-o', 'ControlMaster=yes',
+                '-o', f'ControlPath={self.control_path(hostname)}',
+                '-o', f'ControlPersist={self.persist}',
+                hostname]
+
+    def warmed(self, hostname, success):
+        with self.lock:
+            self.starting.discard(hostname)
+            if not success:
+                self.masters.pop(hostname, None)
+
+    def _evict(self) -> list:
+        # Forgets masters that exited on their own, then the least recently used ones beyond `size`
+        for hostname in [h for h in self.masters if h not in self.starting and not self.is_alive(h)]:
+            del self.masters[hostname]
+        evicted = []
+        while len(self.masters) > self.size:
+            hostname = next(iter(self.masters))
+            del self.masters[hostname]
+            evicted.append(hostname)
+        return evicted
+
+    def _stop(self, hostnames):
+        # On a thread of its own, a master that doesn't answer would otherwise hold up the UI thread
+        if hostnames:
+            threading.Thread(target=self._run_stop, args=(hostnames,), daemon=True).start()
+
+    def _run_stop(self, hostnames):
+        # 'stop' lets sessions that use the master continue, it only stops accepting new ones
+        for hostname in hostnames:
+            if self.is_alive(hostname):
+                try:
+                    subprocess.run(['ssh', '-O', 'stop', '-o', f'ControlPath={self.control_path(hostname)}', hostname],
+                                   stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=5)
+                except (OSError, subprocess.TimeoutExpired):
+                    pass
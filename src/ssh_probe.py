@@ -0,0 +1,454 @@
+import asyncio
+import errno
+import os
+import queue
+import socket
+import threading
+import time
+
+# Every authentication method is disabled, so a host that is up answers with "Permission denied"
+SSH_PROBE_OPTIONS = [
+    '-o', 'BatchMode=yes',
+    '-o', 'ConnectTimeout=3',
+    '-o', 'PubkeyAuthentication=no',
+    '-o', 'PasswordAuthentication=no',
+    '-o', 'KbdInteractiveAuthentication=no',
+    '-o', 'ChallengeResponseAuthentication=no',
+    '-o', 'StrictHostKeyChecking=no',
+]
+
+# Probe modes: 'ssh' runs the ssh client, 'banner' only reads the server greeting over a socket
+PROBE_MODES = ('ssh', 'banner')
+
+# Why a probe failed, 'auth' means the server answered but the connection failed before authentication
+FAILURE_CLASSES = ('timeout', 'refused', 'dns', 'unreachable', 'reset', 'auth', 'protocol', 'error')
+
+# ssh only reports why it failed on stderr
+SSH_FAILURE_MESSAGES = [
+    (b'Could not resolve hostname', 'dns'),
+    (b'Name or service not known', 'dns'),
+    (b'Connection refused', 'refused'),
+    (b'timed out', 'timeout'),
+    (b'No route to host', 'unreachable'),
+    (b'Network is unreachable', 'unreachable'),
+    (b'Connection reset', 'reset'),
+    (b'Connection closed', 'reset'),
+    (b'kex_exchange_identification', 'reset'),
+    (b'Host key verification failed', 'auth'),
+    (b'Unable to negotiate', 'auth'),
+]
+
+class ProbeResult:
+    __slots__ = ('reachable', 'failure', 'latency', 'timestamp')
+
+    def __init__(self, reachable, failure=None, latency=None, timestamp=None):
+        # failure is one of FAILURE_CLASSES, or None for reachable hosts, latency is in seconds
+        self.reachable = reachable
+        self.failure = failure
+        self.latency = latency
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    def state(self) -> str:
+        # The host's Reachable value, names that don't resolve have their own state
+        if self.reachable:
+            return 'yes'
+        return 'dns' if self.failure == 'dns' else 'no'
+
+class ProbeTarget:
+    def __init__(self, address, port=22, proxy_jump=None, proxy_command=None):
+        self.address = address
+        self.port = port
+        self.proxy_jump = proxy_jump
+        self.proxy_command = proxy_command
+        # Addresses of `address` from the DNS cache, connected to instead of resolving it
+        self.addresses = []
+
+    def is_proxied(self) -> bool:
+        return self.proxy_jump is not None or self.proxy_command is not None
+
+def get_probe_target(hostname, hostconfig) -> ProbeTarget:
+    address = hostconfig.get('HostName', hostname)
+    try:
+        port = int(hostconfig.get('Port', 22))
+    except ValueError:
+        port = 22
+    proxy_jump = hostconfig.get('ProxyJump')
+    proxy_command = hostconfig.get('ProxyCommand')
+    # 'none' disables a ProxyJump/ProxyCommand inherited from a wildcard block
+    if proxy_jump is not None and proxy_jump.lower() == 'none':
+        proxy_jump = None
+    if proxy_command is not None and proxy_command.lower() == 'none':
+        proxy_command = None
+    return ProbeTarget(address, port, proxy_jump, proxy_command)
+
+def get_probe_mode(hostconfig, target, default_mode='ssh', category_modes=None) -> str:
+    mode = default_mode
+    if category_modes:
+        mode = category_modes.get(hostconfig.get('Category'), default_mode)
+    if mode not in PROBE_MODES:
+        mode = 'ssh'
+    # A socket can't follow a jump host, so proxied hosts are always probed with ssh
+    if mode == 'banner' and target.is_proxied():
+        mode = 'ssh'
+    return mode
+
+def get_ssh_probe_command(target) -> list:
+    command = ['ssh', *SSH_PROBE_OPTIONS, '-p', str(target.port)]
+    if target.proxy_jump is not None:
+        command += ['-J', target.proxy_jump]
+    if target.proxy_command is not None:
+        command += ['-o', f'ProxyCommand={target.proxy_command}']
+    if len(target.addresses) == 1:
+        # Host keys are still looked up under the name
+        command += ['-o', f'HostKeyAlias={target.address}', '-o', 'CheckHostIP=no', target.addresses[0]]
+    else:
+        # ssh tries each address of a name itself, moving on from one that doesn't answer (e.g. IPv6 without a route)
+        command.append(target.address)
+    return command
+
+def is_auth_rejected(stderr) -> bool:
+    return b'Permission denied' in stderr
+
+def classify_ssh_failure(stderr) -> str:
+    for message, failure in SSH_FAILURE_MESSAGES:
+        if message in stderr:
+            return failure
+    return 'error'
+
+def classify_socket_error(error) -> str:
+    if isinstance(error, socket.gaierror):
+        return 'dns'
+    if isinstance(error, ConnectionRefusedError):
+        return 'refused'
+    if isinstance(error, (ConnectionResetError, ConnectionAbortedError, BrokenPipeError)):
+        return 'reset'
+    if isinstance(error, TimeoutError):
+        return 'timeout'
+    if error.errno in (errno.EHOSTUNREACH, errno.ENETUNREACH):
+        return 'unreachable'
+    return 'error'
+
+def is_ssh_banner(line) -> bool:
+    # SSH-1.99 is announced by servers that also speak protocol 2
+    return line.startswith(b'SSH-2.0-') or line.startswith(b'SSH-1.99-')
+
+# probe_banner and probe_ssh return None if the host is reachable, or the failure class
+
+async def probe_banner(target, timeout):
+    async def connect():
+        # Like ssh, each address is tried in turn. Each gets a share of the timeout,
+        # so one that doesn't answer leaves time for the others
+        addresses = target.addresses or [target.address]
+        for address in addresses[:-1]:
+            try:
+                return await asyncio.wait_for(asyncio.open_connection(address, target.port), timeout / len(addresses))
+            except (OSError, asyncio.TimeoutError):
+                pass
+        return await asyncio.open_connection(addresses[-1], target.port)
+
+    async def read_banner():
+        reader, writer = await connect()
+        try:
+            # Servers may send other lines before the version string (RFC 4253 4.2)
+            for _ in range(10):
+                line = await reader.readline()
+                if not line:
+                    return 'reset'
+                if line.startswith(b'SSH-'):
+                    return None if is_ssh_banner(line) else 'protocol'
+            return 'protocol'
+        finally:
+            writer.close()
+
+    try:
+        return await asyncio.wait_for(read_banner(), timeout)
+    except asyncio.TimeoutError:
+        return 'timeout'
+    except ValueError:
+        # A line longer than the stream limit, not an ssh server
+        return 'protocol'
+    except OSError as e:
+        return classify_socket_error(e)
+
+async def probe_ssh(target, timeout):
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *get_ssh_probe_command(target),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE)
+    except OSError:
+        return 'error'
+
+    try:
+        _, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        return 'timeout'
+    finally:
+        # Also runs on cancellation, so no ssh process outlives its probe
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+    return None if is_auth_rejected(stderr) else classify_ssh_failure(stderr)
+
+async def probe(target, mode, timeout) -> ProbeResult:
+    started = time.monotonic()
+    if mode == 'banner':
+        failure = await probe_banner(target, timeout)
+    else:
+        failure = await probe_ssh(target, timeout)
+    return ProbeResult(failure is None, failure, time.monotonic() - started)
+
+async def probe_all(ssh_config_data, concurrency=64, timeout=5, mode='ssh', category_modes=None, socket_concurrency=512):
+    """
+    Probes every host in ssh_config_data and stores the result in each host's 'Reachable' value.
+    At most `concurrency` ssh processes and `socket_concurrency` banner sockets are used at a time.
+    Returns the ProbeResult of each host.
+    """
+    semaphores = {'ssh': asyncio.Semaphore(concurrency), 'banner': asyncio.Semaphore(socket_concurrency)}
+    results = {}
+
+    async def probe_one(hostname, hostconfig):
+        target = get_probe_target(hostname, hostconfig)
+        host_mode = get_probe_mode(hostconfig, target, mode, category_modes)
+        async with semaphores[host_mode]:
+            result = await probe(target, host_mode, timeout)
+        hostconfig['Reachable'] = result.state()
+        results[hostname] = result
+
+    await asyncio.gather(*(probe_one(k, v) for k, v in ssh_config_data.items()))
+    return results
+
+class WakeupQueue(queue.Queue):
+    """
+    A queue with a file descriptor that becomes readable when something is put on it,
+    so a select() loop can wait for it together with other input.
+    """
+    def __init__(self):
+        super().__init__()
+        self.read_fd, self.write_fd = os.pipe()
+        os.set_blocking(self.read_fd, False)
+        os.set_blocking(self.write_fd, False)
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+        try:
+            os.write(self.write_fd, b'\0')
+        except BlockingIOError:
+            # The pipe is full, so the reader will wake up anyway
+            pass
+
+    def fileno(self) -> int:
+        return self.read_fd
+
+    def drain(self) -> list:
+        # The pipe is emptied first, so anything put after this still wakes the reader
+        try:
+            while os.read(self.read_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        items = []
+        while True:
+            try:
+                items.append(self.get_nowait())
+            except queue.Empty:
+                return items
+
+    def close(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+class ProbeEngine:
+    """
+    Runs reachability probes on an asyncio loop in a background thread.
+    At most `concurrency` ssh probes and `socket_concurrency` banner probes run at once,
+    and each is limited to `timeout` seconds. `mode` is the default probe mode and
+    `category_modes` maps category names to a mode that overrides it.
+    Each finished probe is put on `results`, a WakeupQueue, as a (hostname, reachable, latency, failure) tuple,
+    where reachable is 'yes', 'no' or 'dns' (the HostName didn't resolve), latency is the probe duration
+    in seconds and failure is one of FAILURE_CLASSES, or None for reachable hosts.
+    With a ssh_dns.Resolver, HostNames are looked up in its cache (or resolved on its threads) before
+    the probe starts, so slow DNS doesn't count against the probe timeout.
+    With a ssh_pool.ControlPool, a master connection is started for every reachable host,
+    so connecting to it afterwards skips the handshake.
+    Hosts waiting for a free slot are started in order of prioritize(): hosts on screen first,
+    then the hosts of the current list, then the rest in the order they were queued.
+    """
+    def __init__(self, concurrency=64, timeout=5, mode='ssh', category_modes=None, socket_concurrency=512, pool=None, results=None, resolver=None):
+        self.limits = {'ssh': concurrency, 'banner': socket_concurrency}
+        self.timeout = timeout
+        self.mode = mode
+        self.category_modes = category_modes or {}
+        self.pool = pool
+        self.resolver = resolver
+        # A queue can be passed in, when the engine takes over from something else that put results on it
+        self.results = results if results is not None else WakeupQueue()
+        self.lock = threading.Lock()
+        self.queued = set()
+        self.tasks = set()
+        # Only used on the loop's thread: hosts waiting for a slot of each mode, in the order they were queued,
+        # the number of running probes of each mode and the hosts prioritize() puts first
+        self.waiting = {mode: {} for mode in PROBE_MODES}
+        self.running = {mode: 0 for mode in PROBE_MODES}
+        self.viewport = []
+        self.preferred = []
+        self.preferred_set = set()
+        self.preferred_waiting = None
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def probe(self, hostname, hostconfig, max_age=None) -> bool:
+        # Returns False if the host is already waiting for a result.
+        # `max_age` is for the interface of ssh_daemon.DaemonClient, the engine always probes
+        return self.probe_all({hostname: hostconfig}) == 1
+
+    def probe_all(self, ssh_config_data) -> int:
+        # Queues the hosts in one go, so the first free slots go to the best ranked of them.
+        # Returns the number of hosts that weren't already waiting for a result
+        queue = []
+        for hostname, hostconfig in ssh_config_data.items():
+            with self.lock:
+                if hostname in self.queued:
+                    continue
+                self.queued.add(hostname)
+            target = get_probe_target(hostname, hostconfig)
+            queue.append((hostname, target, get_probe_mode(hostconfig, target, self.mode, self.category_modes)))
+        if queue:
+            self.loop.call_soon_threadsafe(self._queue, queue)
+        return len(queue)
+
+    def prioritize(self, viewport, preferred=None):
+        """
+        Starts the waiting hosts of `viewport` (the hosts on screen) first, then those of `preferred`
+        (the current category or search result), which is kept if it is None.
+        Neither list may be modified afterwards, since they are read on the loop's thread.
+        """
+        self.loop.call_soon_threadsafe(self._prioritize, viewport, preferred)
+
+    def _prioritize(self, viewport, preferred):
+        self.viewport = viewport
+        if preferred is not None and preferred is not self.preferred:
+            self.preferred = preferred
+            # Built when a host is next started, so switching lists quickly only costs the last one
+            self.preferred_waiting = None
+
+    def _queue(self, queue):
+        for hostname, target, mode in queue:
+            self.waiting[mode][hostname] = target
+            if self.preferred_waiting is not None and hostname in self.preferred_set:
+                self.preferred_waiting[mode][hostname] = True
+        for mode in PROBE_MODES:
+            self._dispatch(mode)
+
+    def _next(self, mode) -> str:
+        # The waiting host of `mode` to start next
+        waiting = self.waiting[mode]
+        for hostname in self.viewport:
+            if hostname in waiting:
+                return hostname
+        if self.preferred_waiting is None:
+            # The hosts of the preferred list that are waiting, in the order they were queued
+            preferred = self.preferred_set = set(self.preferred)
+            self.preferred_waiting = {mode: {hostname: True for hostname in waiting if hostname in preferred} for mode, waiting in self.waiting.items()}
+        preferred_waiting = self.preferred_waiting[mode]
+        while preferred_waiting:
+            hostname = next(iter(preferred_waiting))
+            del preferred_waiting[hostname]
+            if hostname in waiting:
+                return hostname
+        return next(iter(waiting))
+
+    def _dispatch(self, mode):
+        waiting = self.waiting[mode]
+        while waiting and self.running[mode] < self.limits[mode]:
+            hostname = self._next(mode)
+            target = waiting.pop(hostname)
+            self.running[mode] += 1
+            task = self.loop.create_task(self._probe(hostname, target, mode))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _probe(self, hostname, target, mode):
+        try:
+            started = time.monotonic()
+            if await self._resolve(target):
+                result = await probe(target, mode, self.timeout)
+            else:
+                result = ProbeResult(False, 'dns', time.monotonic() - started)
+            self.results.put((hostname, result.state(), result.latency, result.failure))
+        finally:
+            with self.lock:
+                self.queued.discard(hostname)
+            self.running[mode] -= 1
+            self._dispatch(mode)
+        # Starting a master doesn't take up a probe slot
+        if result.reachable and self.pool is not None:
+            command = self.pool.warm_command(hostname)
+            if command is not None:
+                self.pool.warmed(hostname, await self._warm(command))
+
+    async def _resolve(self, target) -> bool:
+        # Sets the addresses of `target` to connect to, returns False if its name doesn't resolve.
+        # Proxied hosts are resolved by the jump host
+        if self.resolver is None or target.is_proxied():
+            return True
+        try:
+            # Shielded, other probes may be waiting for the same name
+            addresses = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self.resolver.resolve(target.address))), self.timeout)
+        except asyncio.TimeoutError:
+            # A slow resolver doesn't mean the name doesn't exist, the probe resolves it itself
+            return True
+        if addresses is None:
+            # Neither does a resolver that failed for now
+            return True
+        if not addresses:
+            return False
+        target.addresses = addresses
+        return True
+
+    async def _warm(self, command) -> bool:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL)
+        except OSError:
+            return False
+        try:
+            # ssh -f returns once the master is authenticated and in the background
+            await asyncio.wait_for(process.wait(), self.timeout * 2)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+        return process.returncode == 0
+
+    async def _cancel_all(self):
+        # Hosts still waiting are dropped, so cancelled probes don't start them
+        for waiting in self.waiting.values():
+            with self.lock:
+                self.queued.difference_update(waiting)
+            waiting.clear()
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self):
+        # Cancels running probes (killing their ssh processes) and stops the loop
+        if not self.loop.is_closed():
+            asyncio.run_coroutine_threadsafe(self._cancel_all(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+            self.results.close()
@@ -0,0 +1,68 @@
+import threading
+import ssh_hosts
+import ssh_probe
+import ssh_search
+
+class HostChanges:
+    """
+    Hosts that were read again after the files they come from changed: `hosts` in config order,
+    the names that were `added`, `removed` or `changed` (another HostName, Category or options)
+    since the previous read, and a SearchIndex over `hosts`.
+    """
+    __slots__ = ('hosts', 'added', 'removed', 'changed', 'search_index')
+
+    def __init__(self, hosts, added, removed, changed, search_index):
+        self.hosts = hosts
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+        self.search_index = search_index
+
+class ConfigReloader:
+    """
+    Checks every `interval` seconds whether the files in `sources` (a ssh_hosts.ConfigSources) changed,
+    on a background thread. If they did, `load(sources)` reads the hosts again and fills a new ConfigSources
+    with the files it read, the result is compared with the previous read and a search index is built
+    for it, reusing the search texts of unchanged hosts. Each read that changed anything is put
+    on `results`, a WakeupQueue, as a HostChanges.
+    `hosts` are the hosts that were read first, they are copied since the caller keeps changing its dict.
+    """
+    def __init__(self, load, hosts, sources, search_index, notes_dir=None, notes_index=None, interval=2):
+        self.load = load
+        self.hosts = dict(hosts)
+        self.sources = sources
+        self.search_index = search_index
+        self.notes_dir = notes_dir
+        self.notes_index = notes_index
+        self.interval = interval
+        self.results = ssh_probe.WakeupQueue()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            if self.sources.is_current():
+                continue
+            sources = ssh_hosts.ConfigSources()
+            try:
+                hosts = self.load(sources)
+            except (OSError, ValueError, KeyError, AttributeError):
+                # A file that is still being written, it is read again on the next check
+                continue
+            self.sources = sources
+            # An empty file is more likely saved halfway than meant to remove every host
+            if not hosts:
+                continue
+            added, removed, changed = ssh_hosts.diff_hosts(self.hosts, hosts)
+            if not added and not removed and not changed and list(hosts) == list(self.hosts):
+                continue
+            self.search_index = ssh_search.SearchIndex(hosts, self.notes_dir, self.notes_index, self.search_index, changed)
+            self.hosts = hosts
+            self.results.put(HostChanges(hosts, added, removed, changed, self.search_index))
+
+    def stop(self):
+        # Waits for a read that is in progress, so nothing is put on the closed queue
+        self.stopping.set()
+        self.thread.join()
+        self.results.close()
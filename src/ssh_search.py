@@ -0,0 +1,338 @@
+import os
+import time
+import threading
+
+# Fields that are searched besides the host name
+SEARCH_FIELDS = ['HostName', 'Aliases', 'User']
+
+FUZZY_MATCH = 16
+FUZZY_CONSECUTIVE = 8
+FUZZY_START = 12
+FUZZY_DOT = 10
+FUZZY_BOUNDARY = 8
+FUZZY_MAX_GAP_PENALTY = 10
+FUZZY_NAME_BONUS = 4
+# Fuzzy searches over more candidates than this are ranked in the background...
+FUZZY_BACKGROUND_CANDIDATES = 2000
+# ...this many at a time, letting the UI thread run in between
+FUZZY_BACKGROUND_CHUNK = 500
+BOUNDARY_CHARACTERS = '-_ /@:'
+
+def get_trigrams(text) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def fuzzy_score(query, text):
+    """
+    Scores `text` for a fuzzy `query`, fzf style, or returns None if the query
+    is not a subsequence of the text. Matches at the start of the text, after a dot or
+    after a word boundary and consecutive matches score higher, gaps score lower.
+    """
+    # Find the leftmost occurrence of the whole subsequence...
+    index = -1
+    find = text.find
+    for char in query:
+        index = find(char, index + 1)
+        if index < 0:
+            return None
+    # ...then walk back from its end, which gives the shortest window ending there
+    rfind = text.rfind
+    score = 0
+    following = None
+    index += 1
+    for char in reversed(query):
+        index = rfind(char, 0, index)
+        score += FUZZY_MATCH
+        if following is not None:
+            if following == index + 1:
+                score += FUZZY_CONSECUTIVE
+            else:
+                score -= min(following - index + 1, FUZZY_MAX_GAP_PENALTY)
+        if index == 0:
+            score += FUZZY_START
+        else:
+            before = text[index - 1]
+            if before == '.':
+                score += FUZZY_DOT
+            elif before in BOUNDARY_CHARACTERS:
+                score += FUZZY_BOUNDARY
+        following = index
+    return score
+
+def rank_fuzzy(query, candidates, fuzzy_texts) -> list:
+    """
+    Returns (-score, position) for every candidate that matches, sorted best first.
+    This is score_host with fuzzy_score inlined for the host name,
+    since it runs for every candidate on every keystroke.
+    """
+    scored = []
+    append = scored.append
+    reversed_query = query[::-1]
+    for position in candidates:
+        name, hostname = fuzzy_texts[position]
+        find = name.find
+        index = -1
+        for char in query:
+            index = find(char, index + 1)
+            if index < 0:
+                break
+        if index < 0:
+            if hostname:
+                score = fuzzy_score(query, hostname)
+                if score is not None:
+                    append((-score, position))
+            continue
+        rfind = name.rfind
+        score = FUZZY_NAME_BONUS
+        following = None
+        index += 1
+        for char in reversed_query:
+            index = rfind(char, 0, index)
+            score += FUZZY_MATCH
+            if following is not None:
+                if following == index + 1:
+                    score += FUZZY_CONSECUTIVE
+                else:
+                    score -= min(following - index + 1, FUZZY_MAX_GAP_PENALTY)
+            if index == 0:
+                score += FUZZY_START
+            elif name[index - 1] == '.':
+                score += FUZZY_DOT
+            elif name[index - 1] in BOUNDARY_CHARACTERS:
+                score += FUZZY_BOUNDARY
+            following = index
+        append((-score, position))
+    scored.sort()
+    return scored
+
+def score_host(query, name, hostname):
+    # The host name is preferred, HostName is only scored when the name doesn't match
+    score = fuzzy_score(query, name)
+    if score is not None:
+        return score + FUZZY_NAME_BONUS
+    if hostname:
+        return fuzzy_score(query, hostname)
+    return None
+
+def read_notes(notes_dir, hostnames) -> dict:
+    # Only files named after a host are notes, notes_dir may hold other files too
+    try:
+        filenames = set(os.listdir(notes_dir))
+    except OSError:
+        return {}
+    notes = {}
+    for hostname in hostnames:
+        if hostname in filenames:
+            try:
+                with open(os.path.join(notes_dir, hostname), 'r', errors='replace') as file:
+                    notes[hostname] = file.read()
+            except OSError:
+                pass
+    return notes
+
+class SearchIndex:
+    """
+    Search index over ssh_config_data.
+    Holds the lowercase search text of each host (name, HostName, Aliases, User and notes),
+    the hosts of each category, a trigram index and a fuzzy ranking for every single character,
+    which are built in a background thread. Until they are ready searches scan all hosts instead.
+    A search that extends the previous one only narrows down the previous result.
+    Notes can also be searched through `notes_index`, an ssh_notes.NotesIndex that is loaded
+    and brought up to date in the background, instead of being part of the search text.
+    Hosts whose notes contain every word of a query are added to the hosts matching its text.
+    Fuzzy searches rank the hosts by fuzzy_score and keep the matches of each prefix of the query,
+    so typing and deleting characters only scores hosts that matched the shorter query.
+    When that still leaves more than FUZZY_BACKGROUND_CANDIDATES hosts they are ranked in a
+    background thread, and the ranking of the longest prefix is returned until `ranking` is None again.
+    When the hosts were read again, the search text of each host that isn't `changed` is taken from
+    the `previous` index instead of being built (and its notes read) again.
+    """
+    def __init__(self, ssh_config_data, notes_dir=None, notes_index=None, previous=None, changed=()):
+        self.hosts = list(ssh_config_data.keys())
+        self.notes_index = notes_index
+        changed = set(changed)
+        reused = {}
+        if previous is not None:
+            reused = {hostname: previous.texts[position] for hostname, position in previous.positions.items() if hostname not in changed}
+        notes = read_notes(notes_dir, [hostname for hostname in self.hosts if hostname not in reused]) if notes_dir and notes_index is None else {}
+        self.texts = []
+        self.fuzzy_texts = []
+        self.categories = {}
+        self.host_categories = []
+        self.positions = {}
+        for position, (hostname, hostconfig) in enumerate(ssh_config_data.items()):
+            self.positions[hostname] = position
+            self.host_categories.append(hostconfig.category)
+            self.fuzzy_texts.append((hostname.lower(), (hostconfig.hostname or '').lower()))
+            text = reused.get(hostname)
+            if text is None:
+                fields = [hostname] + [hostconfig.get(field, '') for field in SEARCH_FIELDS]
+                if hostname in notes:
+                    fields.append(notes[hostname])
+                # Fields are joined by newlines, which can't be typed in the search panel,
+                # so a match never spans two fields
+                text = '\n'.join(fields).lower()
+            self.texts.append(text)
+            self.categories.setdefault(hostconfig.category, []).append(position)
+        self.trigrams = None
+        self.last_search = None
+        self.last_positions = None
+        self.last_hosts = None
+        self.last_notes_version = None
+        self.fuzzy_category = None
+        self.fuzzy_matches = {}
+        self.fuzzy_results = {}
+        # (category, query) of the fuzzy search that is being ranked in the background
+        self.ranking = None
+        self.lock = threading.Lock()
+        self.character_rankings = None
+        threading.Thread(target=self.build, daemon=True).start()
+
+    def build(self):
+        self.build_trigrams()
+        self.build_character_rankings()
+        if self.notes_index is not None:
+            # An index over hosts that were read again is already loaded
+            if self.notes_index.index is None:
+                self.notes_index.load()
+            self.notes_index.update(self.hosts)
+
+    def build_character_rankings(self):
+        # The ranking of every one character query, so the first keystroke needs no scoring
+        scores = {}
+        for position, (name, hostname) in enumerate(self.fuzzy_texts):
+            for char in set(name) | set(hostname):
+                scores.setdefault(char, []).append((-score_host(char, name, hostname), position))
+        self.character_rankings = {char: [position for _, position in sorted(ranking)] for char, ranking in scores.items()}
+
+    def build_trigrams(self):
+        trigrams = {}
+        for position, text in enumerate(self.texts):
+            for trigram in get_trigrams(text):
+                posting = trigrams.get(trigram)
+                if posting is None:
+                    trigrams[trigram] = posting = []
+                posting.append(position)
+        self.trigrams = trigrams
+
+    def get_candidates(self, category, query) -> list:
+        if category == 'All':
+            positions = range(len(self.hosts))
+        else:
+            positions = self.categories.get(category, [])
+        trigrams = self.trigrams
+        if len(query) < 3 or trigrams is None:
+            return positions
+
+        postings = []
+        for trigram in get_trigrams(query):
+            posting = trigrams.get(trigram)
+            if posting is None:
+                return []
+            postings.append(posting)
+        postings.sort(key=len)
+        # A scan is cheaper than intersecting postings that cover most hosts anyway
+        if len(postings[0]) > len(positions) // 2:
+            return positions
+        candidates = set(postings[0]).intersection(*postings[1:])
+        if category != 'All':
+            candidates.intersection_update(positions)
+        return sorted(candidates)
+
+    def search(self, category, query) -> list:
+        # Returns the matching host names in config order, the list must not be modified
+        query = query.lower()
+        notes_index = self.notes_index
+        notes_version = notes_index.version if notes_index is not None else None
+        if self.last_search == (category, query) and self.last_notes_version == notes_version:
+            return self.last_hosts
+
+        if self.last_search is not None and self.last_search[0] == category and self.last_search[1] in query:
+            # Anything matching the new query also matched the previous one
+            candidates = self.last_positions
+        else:
+            candidates = self.get_candidates(category, query)
+
+        texts = self.texts
+        positions = [p for p in candidates if query in texts[p]] if query else list(candidates)
+        self.last_search = (category, query)
+        self.last_notes_version = notes_version
+        # Only text matches narrow down the next search, a longer query can match other notes
+        self.last_positions = positions
+
+        if query and notes_index is not None:
+            noted = [self.positions.get(hostname) for hostname in notes_index.search(query)]
+            noted = {p for p in noted if p is not None and (category == 'All' or self.host_categories[p] == category)}
+            if noted:
+                positions = sorted(noted.union(positions))
+        self.last_hosts = [self.hosts[p] for p in positions]
+        return self.last_hosts
+
+    def search_fuzzy(self, category, query) -> list:
+        # Returns the matching host names, best match first, the list must not be modified
+        query = query.lower()
+        if not query:
+            return self.search(category, query)
+        with self.lock:
+            if self.fuzzy_category != category:
+                self.fuzzy_category = category
+                self.fuzzy_matches = {}
+                self.fuzzy_results = {}
+            if query in self.fuzzy_results:
+                return self.fuzzy_results[query]
+
+            # Forget the results of queries that aren't a prefix of this one
+            for cached in [q for q in self.fuzzy_matches if not query.startswith(q)]:
+                del self.fuzzy_matches[cached]
+                del self.fuzzy_results[cached]
+
+            prefixes = [q for q in self.fuzzy_matches if query.startswith(q)]
+            character_rankings = self.character_rankings
+            if len(query) == 1 and character_rankings is not None:
+                ranking = character_rankings.get(query, [])
+                if category != 'All':
+                    members = set(self.categories.get(category, []))
+                    ranking = [position for position in ranking if position in members]
+                self.fuzzy_matches[query] = sorted(ranking)
+                self.fuzzy_results[query] = [self.hosts[position] for position in ranking]
+                return self.fuzzy_results[query]
+            elif prefixes:
+                candidates = self.fuzzy_matches[max(prefixes, key=len)]
+            elif category == 'All':
+                candidates = range(len(self.hosts))
+            else:
+                candidates = self.categories.get(category, [])
+
+            if len(candidates) > FUZZY_BACKGROUND_CANDIDATES:
+                # Scoring this many hosts takes longer than a frame, the UI keeps responding meanwhile
+                if self.ranking != (category, query):
+                    self.ranking = (category, query)
+                    threading.Thread(target=self.rank_fuzzy_in_background, args=(category, query, candidates), daemon=True).start()
+                if prefixes:
+                    return self.fuzzy_results[max(prefixes, key=len)]
+                return self.search(category, '')
+
+        scored = rank_fuzzy(query, candidates, self.fuzzy_texts)
+        with self.lock:
+            self.store_fuzzy(query, scored)
+        return self.fuzzy_results[query]
+
+    def rank_fuzzy_in_background(self, category, query, candidates):
+        scored = []
+        for start in range(0, len(candidates), FUZZY_BACKGROUND_CHUNK):
+            # Gives up the GIL, so keys are handled without waiting for the switch interval
+            time.sleep(0)
+            # Another query was typed meanwhile, it starts its own ranking
+            if self.ranking != (category, query):
+                return
+            scored.extend(rank_fuzzy(query, candidates[start:start + FUZZY_BACKGROUND_CHUNK], self.fuzzy_texts))
+        scored.sort()
+        with self.lock:
+            if self.ranking != (category, query):
+                return
+            self.ranking = None
+            if self.fuzzy_category == category:
+                self.store_fuzzy(query, scored)
+
+    def store_fuzzy(self, query, scored):
+        self.fuzzy_matches[query] = sorted(position for _, position in scored)
+        self.fuzzy_results[query] = [self.hosts[position] for _, position in scored]
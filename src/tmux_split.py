@@ -1,7 +1,10 @@
 import os
-import time
 import argparse
 import re
+import shlex
+import subprocess
+import threading
+from ssh_probe import WakeupQueue
 
 def sanitize_hostname(hostname):
     """
@@ -10,61 +13,154 @@ def sanitize_hostname(hostname):
     # Replace periods, colons, and other problematic characters with underscores
     return re.sub(r'[.:]', '_', hostname)
 
-def open_in_tmux(name, commands):
-    # Get the pane-base-index setting (oh-my-tmux has base-index at 1)
-    pane_base_index = int(os.popen('tmux show-option -gqv base-index').read().strip())
+def pane_command(command) -> str:
+    """
+    Shell command for a new pane that runs `command` and then leaves an interactive shell,
+    so the pane stays open (like a typed command would) when the command exits.
+    """
+    # A command that already ends with a separator would end up with ';;', a syntax error
+    command = command.rstrip(' \t\n;')
+    return f'{command}; exec "${{SHELL:-/bin/sh}}"'
 
-    os.system(f'tmux new-window -n {name}')
-    for i in range(len(commands)-1):
+def run_tmux(chain):
+    """
+    Runs a list of tmux commands (each a list of arguments) as a single tmux invocation,
+    separated by ';' arguments, so the whole layout is built by one process.
+    """
+    args = ['tmux']
+    for i, command in enumerate(chain):
+        if i > 0:
+            args.append(';')
+        # tmux would read a trailing ';' as a command separator
+        args += [arg[:-1] + '\\;' if arg.endswith(';') else arg for arg in command]
+    return subprocess.run(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+def open_in_tmux(name, commands):
+    # Each pane is created running its command, so there is no shell to wait for before typing into it
+    if not commands:
+        return
+    chain = [['new-window', '-n', name, pane_command(commands[0])]]
+    for i, command in enumerate(commands[1:]):
         direction = '-v' if i%2==0 else '-h'
-        os.system(f'tmux split-window {direction}')
-        os.system('tmux selectl tiled')
-        
-    time.sleep(0.2)
-    for i in range(len(commands)):
-        adjusted_i = i + pane_base_index
-        os.system(f'tmux send-keys -t {adjusted_i} {commands[i]}')
+        chain.append(['split-window', direction, pane_command(command)])
+        # Tiling after every split keeps room for the next one
+        chain.append(['select-layout', 'tiled'])
+    run_tmux(chain)
+
+def get_ssh_command(host, pool=None) -> str:
+    # With a ssh_pool.ControlPool the connection reuses (or starts) the host's master connection
+    options = pool.ssh_options(host) if pool is not None else []
+    return shlex.join(['ssh', *options, host])
 
-def open_ssh_hosts(hosts):
+def open_ssh_hosts(hosts, pool=None):
     commands = []
-    for i in range(len(hosts)):
-        commands.append(f'ssh Space {hosts[i]} Enter')
+    for host in hosts:
+        commands.append(get_ssh_command(host, pool))
     open_in_tmux('ssh', commands)
 
 def demo():
     colors = ['green', 'red', 'blue','white','yellow','cyan','magenta','black']
     commands = []
     for i in range(4):
-        #commands.append('ssh Space tussi Enter')       
-        commands.append(f'cmatrix Space -b Space -a Space -C Space {colors[i]} Enter')
-    #commands.append('ssh Space fakir Enter')
-    #commands.append('ssh Space dockerbuntu Enter')
+        #commands.append('ssh tussi')
+        commands.append(f'cmatrix -b -a -C {colors[i]}')
+    #commands.append('ssh fakir')
+    #commands.append('ssh dockerbuntu')
     open_in_tmux('ssh1', commands)
 
-def open_nested_tmux_windows(hosts):
+class WindowMonitor:
+    """
+    Collects what happens to the ssh sessions of nested tmux windows.
+    The windows report to a named pipe at `filename`: ssh's LocalCommand writes "ready <host>"
+    once the session is up, and the pane writes "exit <status> <host>" when ssh exits.
+    Windows whose session goes over a running ControlMaster report "ready" themselves,
+    since ssh doesn't run LocalCommand then.
+    A host whose ssh exits with status 255 (ssh's own errors) before it was ready failed to connect
+    and is put on `events`, a WakeupQueue, as a (host, status) tuple. Any other status is the
+    remote command's, so the session was up even if no "ready" arrived.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.events = WakeupQueue()
+        self.ready = set()
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        if os.path.exists(filename):
+            os.unlink(filename)
+        os.mkfifo(filename, 0o600)
+        # Opened for reading and writing, so the pipe never reaches end of file
+        # and windows never block opening it
+        self.fd = os.open(filename, os.O_RDWR)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        buffer = b''
+        while True:
+            data = os.read(self.fd, 4096)
+            buffer += data
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                event, _, host = line.decode(errors='replace').partition(' ')
+                if event == 'stop':
+                    return
+                elif event == 'ready':
+                    self.ready.add(host)
+                elif event == 'exit':
+                    status, _, host = host.partition(' ')
+                    if status == '255' and host not in self.ready:
+                        self.events.put((host, status))
+                    self.ready.discard(host)
+
+    def report_command(self, message, host) -> str:
+        # Windows only write while the pipe exists, so a window outliving ssh-browse never blocks.
+        # `message` is expanded by the shell, so it can refer to variables
+        filename = shlex.quote(self.filename)
+        return f"[ -p {filename} ] && printf '%s %s\\n' \"{message}\" {shlex.quote(host)} > {filename}"
+
+    def stop(self):
+        # Stopping twice does nothing
+        if self.fd is None:
+            return
+        try:
+            os.unlink(self.filename)
+        except FileNotFoundError:
+            # Cleaned up from under us, e.g. by a tmp cleaner
+            pass
+        os.write(self.fd, b'stop\n')
+        self.thread.join()
+        os.close(self.fd)
+        self.fd = None
+        self.events.close()
+
+def open_nested_tmux_windows(hosts, monitor=None, pool=None):
     """
     Opens separate tmux windows for each host, connects via SSH, and starts nested tmux.
     Each window is named after the host (sanitized for tmux compatibility).
     The command tries to attach to an existing session first, or creates a new one if none exists.
+    All windows are created by one tmux invocation, so the hosts connect in parallel.
+    With a WindowMonitor, hosts that fail to connect are reported to it.
     """
+    chain = []
     for host in hosts:
         # Sanitize hostname for use as tmux window name
         window_name = sanitize_hostname(host)
-        # Create a new window with the sanitized host name
-        os.system(f'tmux new-window -n {window_name}')
-        # Send SSH command and then start tmux on the remote host
-        os.system(f'tmux send-keys -t {window_name} "ssh {host}" Enter')
-        # Wait a moment for SSH connection to establish
-        time.sleep(1.5)
-        # Try to attach to existing tmux session, or create new one if it doesn't exist
-        # The "# " comment helps prevent issues if tmux attach fails
-        os.system(f'tmux send-keys -t {window_name} "tmux a # 2>/dev/null || tmux" Enter')
-
-def command_to_sendkeys(command) -> str:
-    s = command.split(' ')
-    s = ' Space '.join(s)
-    s += ' Enter'
-    return s
+        options = ['-t']
+        if pool is not None:
+            options += pool.ssh_options(host)
+        if monitor is not None:
+            # LocalCommand runs once the connection is up, % starts a token in it
+            local_command = monitor.report_command('ready', host).replace('%', '%%')
+            options += ['-o', 'PermitLocalCommand=yes', '-o', f'LocalCommand={local_command}']
+        # tmux is started as the remote command, so it runs as soon as the session is up
+        command = f"{shlex.join(['ssh', *options, host])} 'tmux a 2>/dev/null || tmux'"
+        if monitor is not None and pool is not None:
+            # ssh doesn't run LocalCommand for a session over a running master, which is already connected
+            command = f"{shlex.join(pool.check_command(host))} 2>/dev/null && {monitor.report_command('ready', host)}; {command}"
+        if monitor is not None:
+            command += f"; status=$?; {monitor.report_command('exit $status', host)}"
+        chain.append(['new-window', '-n', window_name, pane_command(command)])
+    if chain:
+        run_tmux(chain)
 
 if __name__ == '__main__':
     
@@ -81,7 +177,7 @@ if __name__ == '__main__':
         try:
             with open(args.filename, 'r', encoding='utf-8') as file:
                 for line in file:
-                    commands.append(command_to_sendkeys(line.rstrip()))
+                    commands.append(line.rstrip())
         except:
             print("Error could not load file!")
         finally: